@@ -8,5 +8,11 @@ def create_api(app):
     api = Api(app)
     api.add_resource(resources.LoginResource, '/api/login')
     api.add_resource(resources.MeResource, '/api/me')
+    api.add_resource(resources.UserDebtsBulkResource, '/api/me/debts/bulk')
+    api.add_resource(resources.UserDebtsExportResource, '/api/me/debts/export')
     api.add_resource(resources.UserDebtsResource, '/api/me/debts', '/api/me/debts/<int:debt_id>')
+    api.add_resource(resources.UserPaymentsBatchResource, '/api/me/payments/batch')
+    api.add_resource(resources.UserPaymentsExportResource, '/api/me/payments/export')
+    api.add_resource(resources.UserPaymentsSummaryResource, '/api/me/payments/summary')
     api.add_resource(resources.UserPaymentsResource, '/api/me/payments', '/api/me/payments/<int:payment_id>')
+    api.add_resource(resources.UserJobsResource, '/api/me/jobs/<string:job_id>')
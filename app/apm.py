@@ -1,10 +1,9 @@
 # -*- coding: utf-8 -*-
 
-from elasticapm.contrib import flask as flask_apm
-
 monitor = None
 
 
 def create_monitor(app):
     global monitor
+    from elasticapm.contrib import flask as flask_apm
     monitor = flask_apm.ElasticAPM(app)
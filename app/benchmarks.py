@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+from copy import deepcopy
+from datetime import date
+from decimal import Decimal
+from threading import Thread
+from timeit import default_timer
+import json
+import subprocess
+import sys
+import uuid
+
+from sqlalchemy import event, literal, select
+
+from app import database, domain, models, hashing
+
+
+class StatementCounter(object):
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+
+    def count_statement(self, *args, **kwargs):
+        self.statements += 1
+
+    def count_commit(self, *args, **kwargs):
+        self.commits += 1
+
+
+@contextmanager
+def count_statements():
+    """
+    Counts the statements and commits sent to the database engine inside the block
+    """
+    engine = database.AppRepository.db.engine
+    counter = StatementCounter()
+    event.listen(engine, 'before_cursor_execute', counter.count_statement)
+    event.listen(engine, 'commit', counter.count_commit)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter.count_statement)
+        event.remove(engine, 'commit', counter.count_commit)
+
+
+@contextmanager
+def count_statements_by_bind():
+    """
+    Counts the statements sent to the primary and to the replica engine inside the block
+    """
+    db = database.AppRepository.db
+    engines = {'primary': db.engine, 'replica': db.get_engine(bind='replica')}
+    counters = {name: StatementCounter() for name in engines}
+    for name, engine in engines.items():
+        event.listen(engine, 'before_cursor_execute', counters[name].count_statement)
+    try:
+        yield counters
+    finally:
+        for name, engine in engines.items():
+            event.remove(engine, 'before_cursor_execute', counters[name].count_statement)
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def latency_summary(latencies, elapsed):
+    return {
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def seeded_months(months):
+    """
+    The `months` (year, month) pairs up to the current month, oldest first
+    """
+    today = date.today()
+    first = today.year * 12 + today.month - months
+    return [(index // 12, index % 12 + 1) for index in range(first, first + months)]
+
+
+def seed(users=100, debts=20, months=12, prefix=None, batch_size=1000, password='benchmark'):
+    """
+    Seeds `users` users with `debts` debts each and their payments for the last `months` months.
+    Users and debts go in with multi-row INSERTs and each month of payments with one INSERT ... SELECT,
+    so it works the same on Postgres and SQLite. All users share one password hash.
+    :return The email prefix of the seeded users
+    :rtype: str
+    """
+    db = database.AppRepository.db
+    prefix = prefix or 'seed-{}'.format(uuid.uuid4().hex[:8])
+    users_table = models.User.__table__
+    debts_table = models.UserDebt.__table__
+    payments_table = models.UserPayment.__table__
+    password_hash = hashing.hash_password(password)
+    for first in range(0, users, batch_size):
+        db.session.execute(users_table.insert().values([
+            {'email': '{}-{}@watshodapay.local'.format(prefix, index), 'password': password_hash, 'name': 'Seed {}'.format(index)}
+            for index in range(first, min(first + batch_size, users))
+        ]))
+    seeded_users = users_table.c.email.like('{}-%'.format(prefix))
+    user_ids = [row[0] for row in db.session.execute(select([users_table.c.id]).where(seeded_users))]
+    debt_rows = (
+        {
+            'user_id': user_id,
+            'description': 'Seed debt {}'.format(index),
+            'expiration_day': (index % 28) + 1,
+            'value': Decimal(10 + index),
+            'quantity': None if index % 3 else months * 2
+        }
+        for user_id in user_ids for index in range(debts)
+    )
+    batch = []
+    for row in debt_rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.execute(debts_table.insert().values(batch))
+            batch = []
+    if batch:
+        db.session.execute(debts_table.insert().values(batch))
+    seeded_months_list = seeded_months(months)
+    for year, month in seeded_months_list:
+        is_current = (year, month) == seeded_months_list[-1]
+        db.session.execute(payments_table.insert().from_select(
+            ['year', 'month', 'value', 'user_id', 'user_debt_id', 'is_payed'],
+            select([
+                literal(year, type_=db.Integer),
+                literal(month, type_=db.Integer),
+                debts_table.c.value,
+                debts_table.c.user_id,
+                debts_table.c.id,
+                literal(not is_current, type_=db.Boolean)
+            ]).select_from(
+                debts_table.join(users_table, debts_table.c.user_id == users_table.c.id)
+            ).where(seeded_users)
+        ))
+    db.session.commit()
+    return prefix
+
+
+def remove_seeded(prefix):
+    db = database.AppRepository.db
+    users_table = models.User.__table__
+    seeded_user_ids = select([users_table.c.id]).where(users_table.c.email.like('{}-%'.format(prefix)))
+    for model in (models.UserPayment, models.UserDebt):
+        table = model.__table__
+        db.session.execute(table.delete().where(table.c.user_id.in_(seeded_user_ids)))
+    db.session.execute(users_table.delete().where(users_table.c.email.like('{}-%'.format(prefix))))
+    db.session.commit()
+
+
+def create_benchmark_user(debts, password='benchmark'):
+    db = database.AppRepository.db
+    user = models.User.create_from_json({
+        'email': 'benchmark-{}@watshodapay.local'.format(uuid.uuid4().hex),
+        'password': hashing.hash_password(password),
+        'name': 'Benchmark'
+    })
+    db.session.add_all([
+        models.UserDebt(
+            user_id=user.id,
+            description='Benchmark debt {}'.format(index),
+            expiration_day=(index % 28) + 1,
+            value=Decimal('10.00'),
+            quantity=None if index % 2 else 12
+        )
+        for index in range(debts)
+    ])
+    db.session.commit()
+    return domain.User.create_with_instance(user)
+
+
+def remove_benchmark_user(user):
+    user.instance.delete_db()
+
+
+def month_payments(debts=40, rounds=5):
+    """
+    Runs the per debt and the set based month payment generation for a user with `debts` debts
+    :return A dict with the mean time, statements and commits per round of each path
+    :rtype: dict
+    """
+    paths = {
+        'per_debt': lambda user, year, month: user.create_month_payments_per_debt(year, month),
+        'set_based': lambda user, year, month: user.create_month_payments(year, month),
+    }
+    results = {}
+    for name, generate in sorted(paths.items()):
+        user = create_benchmark_user(debts)
+        elapsed = 0.0
+        statements = 0
+        commits = 0
+        try:
+            for month in range(1, rounds + 1):
+                with count_statements() as counter:
+                    start = default_timer()
+                    generate(user, 2000, month)
+                    elapsed += default_timer() - start
+                statements += counter.statements
+                commits += counter.commits
+        finally:
+            remove_benchmark_user(user)
+        results[name] = {
+            'ms_per_round': elapsed * 1000 / rounds,
+            'statements_per_round': float(statements) / rounds,
+            'commits_per_round': float(commits) / rounds,
+        }
+    return results
+
+
+def login(concurrency=8, requests=20):
+    """
+    Posts `requests` logins from each of `concurrency` threads to /api/login
+    :return A dict with throughput, latency percentiles and the count of each status code
+    :rtype: dict
+    """
+    from app.http_app import web_app
+    user = create_benchmark_user(0)
+    body = json.dumps({'username': user.email, 'password': 'benchmark'})
+    latencies = []
+    status_codes = {}
+
+    def post_logins():
+        client = web_app.test_client()
+        for _ in range(requests):
+            start = default_timer()
+            response = client.post('/api/login', data=body, content_type='application/json')
+            latencies.append(default_timer() - start)
+            status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+
+    threads = [Thread(target=post_logins) for _ in range(concurrency)]
+    start = default_timer()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = default_timer() - start
+    finally:
+        remove_benchmark_user(user)
+    results = latency_summary(latencies, elapsed)
+    results.update({'status_{}'.format(code): float(count) for code, count in status_codes.items()})
+    return {'login': results}
+
+
+def concurrent_requests(concurrency=16, requests=25, debts=5):
+    """
+    Has `concurrency` threads, each signed in as a different seeded user, call /api/me and /api/me/debts
+    through the same app at the same time, as the threads of a gthread worker do, and checks every response
+    belongs to the user who asked for it
+    :return A dict with throughput, latency percentiles, errors, responses of another user and pool timeouts
+    :rtype: dict
+    """
+    from app.http_app import web_app
+    prefix = seed(users=concurrency, debts=debts, months=1, prefix='benchmark-{}'.format(uuid.uuid4().hex[:8]))
+    latencies = []
+    failures = {'errors': 0, 'wrong_user': 0, 'wrong_debts': 0}
+
+    def call_as_user(index):
+        email = '{}-{}@watshodapay.local'.format(prefix, index)
+        client = web_app.test_client()
+        with web_app.app_context():
+            headers = {'XSRF-TOKEN': domain.User.create_with_email(email).generate_auth_token()}
+        for _ in range(requests):
+            start = default_timer()
+            me = client.get('/api/me', headers=headers)
+            user_debts = client.get('/api/me/debts', headers=headers)
+            latencies.append(default_timer() - start)
+            if me.status_code != 200 or user_debts.status_code != 200:
+                failures['errors'] += 1
+                continue
+            if json.loads(me.data)['email'] != email:
+                failures['wrong_user'] += 1
+            if len(json.loads(user_debts.data)) != debts:
+                failures['wrong_debts'] += 1
+
+    with web_app.app_context():
+        timeouts = database.pool_stats().get('timeouts', 0)
+    threads = [Thread(target=call_as_user, args=(index,)) for index in range(concurrency)]
+    start = default_timer()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = default_timer() - start
+        with web_app.app_context():
+            timeouts = database.pool_stats().get('timeouts', 0) - timeouts
+    finally:
+        remove_seeded(prefix)
+    results = latency_summary(latencies, elapsed)
+    results.update({name: float(count) for name, count in failures.items()})
+    results['pool_timeouts'] = float(timeouts)
+    return {'me_and_debts': results}
+
+
+def run_in_thread(function):
+    """
+    Runs `function` in a new thread, so the requests it makes get their own app context and database session
+    """
+    results = []
+    thread = Thread(target=lambda: results.append(function()))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+def write_endpoints(rounds=20):
+    """
+    Calls the write endpoints with and without the request unit of work
+    :return A dict with the mean time, statements and commits per request of each endpoint and mode
+    :rtype: dict
+    """
+    from app.http_app import web_app
+    debt = {'description': 'Benchmark', 'expirationDay': 10, 'value': 10.0, 'quantity': 12}
+    requests = [
+        ('post_debt', 'post', '/api/me/debts', lambda index: debt),
+        ('post_single_payment', 'post', '/api/me/payments', lambda index: {'single': True, 'year': 2000, 'month': 1, 'debt': debt}),
+        ('post_month_payments', 'post', '/api/me/payments', lambda index: {'year': 2001, 'month': (index % 12) + 1}),
+    ]
+    unit_of_work = web_app.config.get('UNIT_OF_WORK')
+    results = {}
+    try:
+        for mode in (False, True):
+            web_app.config['UNIT_OF_WORK'] = mode
+            user = create_benchmark_user(0)
+            headers = {'XSRF-TOKEN': user.generate_auth_token()}
+            client = web_app.test_client()
+            try:
+                for name, method, url, body in requests:
+                    def call_endpoint():
+                        elapsed = 0.0
+                        with count_statements() as counter:
+                            for index in range(rounds):
+                                start = default_timer()
+                                getattr(client, method)(url, data=json.dumps(body(index)), content_type='application/json', headers=headers)
+                                elapsed += default_timer() - start
+                        return elapsed, counter
+                    elapsed, counter = run_in_thread(call_endpoint)
+                    results['{}_{}'.format(name, 'unit_of_work' if mode else 'commit_per_save')] = {
+                        'ms_per_request': elapsed * 1000 / rounds,
+                        'statements_per_request': float(counter.statements) / rounds,
+                        'commits_per_request': float(counter.commits) / rounds,
+                    }
+            finally:
+                remove_benchmark_user(user)
+    finally:
+        web_app.config['UNIT_OF_WORK'] = unit_of_work
+    return results
+
+
+def endpoints(requests=100, debts=20, months=12):
+    """
+    Drives the main endpoints with the test client for a seeded user with `debts` debts and `months` months of payments
+    :return A dict with throughput, latency percentiles and queries per request of each endpoint
+    :rtype: dict
+    """
+    from app.http_app import web_app
+    prefix = seed(users=1, debts=debts, months=months, prefix='benchmark-{}'.format(uuid.uuid4().hex[:8]))
+    first_year, first_month = seeded_months(months)[0]
+    last_year, last_month = seeded_months(months)[-1]
+    user = domain.User.create_with_email('{}-0@watshodapay.local'.format(prefix))
+    headers = {'XSRF-TOKEN': user.generate_auth_token()}
+    login = json.dumps({'username': user.email, 'password': 'benchmark'})
+    calls = [
+        ('login', lambda client: client.post('/api/login', data=login, content_type='application/json')),
+        ('get_me', lambda client: client.get('/api/me', headers=headers)),
+        ('get_debts', lambda client: client.get('/api/me/debts', headers=headers)),
+        ('get_debts_page', lambda client: client.get('/api/me/debts?limit=20', headers=headers)),
+        ('get_payments', lambda client: client.get('/api/me/payments', headers=headers)),
+        ('get_payments_history', lambda client: client.get(
+            '/api/me/payments?from={}-{:02d}&to={}-{:02d}'.format(first_year, first_month, last_year, last_month),
+            headers=headers
+        )),
+        ('get_payments_summary', lambda client: client.get('/api/me/payments/summary', headers=headers)),
+        ('create_month_payments', lambda client: client.post(
+            '/api/me/payments', data=json.dumps({'year': last_year, 'month': last_month}),
+            content_type='application/json', headers=headers
+        )),
+    ]
+    results = {}
+    try:
+        for name, call in calls:
+            def call_endpoint():
+                client = web_app.test_client()
+                latencies = []
+                with count_statements() as counter:
+                    start = default_timer()
+                    for _ in range(requests):
+                        request_start = default_timer()
+                        call(client)
+                        latencies.append(default_timer() - request_start)
+                    elapsed = default_timer() - start
+                summary = latency_summary(latencies, elapsed)
+                summary['queries_per_request'] = float(counter.statements) / requests
+                return summary
+            results[name] = run_in_thread(call_endpoint)
+    finally:
+        remove_seeded(prefix)
+    return results
+
+
+def replica_routing(email):
+    """
+    Calls the read endpoints and a write endpoint as the user with `email`, which has to be in both databases,
+    like after `createdb -T watshodapay watshodapay_replica` or on a streaming replica
+    :return A dict with the status code and the statements sent to each database by each call
+    :rtype: dict
+    """
+    from app.http_app import web_app
+    user = domain.User.create_with_email(email)
+    headers = {'XSRF-TOKEN': user.generate_auth_token()}
+    calls = [
+        ('get_me', lambda client: client.get('/api/me', headers=headers)),
+        ('get_debts', lambda client: client.get('/api/me/debts', headers=headers)),
+        ('get_payments', lambda client: client.get('/api/me/payments', headers=headers)),
+        ('get_payments_summary', lambda client: client.get('/api/me/payments/summary', headers=headers)),
+        ('put_me', lambda client: client.put(
+            '/api/me', data=json.dumps({'name': user.name}), content_type='application/json', headers=headers
+        )),
+    ]
+    results = {}
+    for name, call in calls:
+        def call_endpoint():
+            with count_statements_by_bind() as counters:
+                response = call(web_app.test_client())
+            return {
+                'status': float(response.status_code),
+                'primary': float(counters['primary'].statements),
+                'replica': float(counters['replica'].statements),
+            }
+        results[name] = run_in_thread(call_endpoint)
+    return results
+
+
+def key_translation(items=500, rounds=20):
+    """
+    Translates the keys of a payments list response with the plain and the memoized snake_to_camel
+    :return A dict with the mean time per round of each translation
+    :rtype: dict
+    """
+    from app import resources
+    payment = {
+        'id': 1, 'date': '2018-05-10', 'value': 10.0, 'status': 'opened', 'is_payed': False, 'payment_info': None,
+        'debt': {'id': 1, 'description': 'Debt', 'expiration_day': 10, 'value': 10.0, 'quantity': None, 'is_recurrent': True}
+    }
+    translations = {
+        'plain': resources.snake_to_camel,
+        'memoized': resources.ResourceBase.snake_to_camel,
+    }
+    results = {}
+    for name, method in sorted(translations.items()):
+        elapsed = 0.0
+        for _ in range(rounds):
+            data = [deepcopy(payment) for _ in range(items)]
+            start = default_timer()
+            resources.transform_keys(data, method)
+            elapsed += default_timer() - start
+        results[name] = {'ms_per_round': elapsed * 1000 / rounds}
+    return results
+
+
+BOOT_SCRIPT = """
+from timeit import default_timer
+import json
+timings = {}
+start = default_timer()
+import app.initialize
+timings['import'] = default_timer() - start
+start = default_timer()
+web_app = app.initialize.create_app()
+timings['create_app'] = default_timer() - start
+start = default_timer()
+web_app.test_client().get('/')
+timings['first_request'] = default_timer() - start
+print(json.dumps(timings))
+"""
+
+
+def boot(rounds=5):
+    """
+    Imports the app and creates it in a fresh interpreter `rounds` times, as a gunicorn worker does without --preload
+    :return A dict with the mean and the slowest time of each boot step
+    :rtype: dict
+    """
+    steps = {}
+    for _ in range(rounds):
+        output = subprocess.check_output([sys.executable, '-c', BOOT_SCRIPT])
+        for step, elapsed in json.loads(output.strip().splitlines()[-1]).items():
+            steps.setdefault(step, []).append(elapsed)
+    return {
+        step: {'mean_ms': sum(times) * 1000 / len(times), 'max_ms': max(times) * 1000}
+        for step, times in steps.items()
+    }
+
+
+def explain_payment_queries(user_id, year, month):
+    """
+    Explains the queries which look for the payments of a user, a debt or a month
+    :return A dict with the plan lines of each query
+    :rtype: dict
+    """
+    db = database.AppRepository.db
+    user = models.User.get(user_id)
+    debt = user.debts.first()
+    queries = {
+        'filter_payments': user.filter_payments(year, month),
+    }
+    if debt is not None:
+        queries['payment_exists'] = user.payments.filter_by(user_debt_id=debt.id, year=year, month=month)
+        queries['debt_payments'] = debt.payments.filter_by(year=year, month=month)
+    explain = 'EXPLAIN ANALYZE' if db.engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN'
+    plans = {}
+    for name, query in queries.items():
+        statement = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+        plans[name] = [' '.join(str(column) for column in row) for row in db.session.execute('{} {}'.format(explain, statement))]
+    return plans
+
+
+def print_results(title, results):
+    print(title)
+    for name, values in sorted(results.items()):
+        print('  {}: {}'.format(name, ', '.join('{}={:.2f}'.format(key, value) for key, value in sorted(values.items()))))
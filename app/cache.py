@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from threading import Lock
+import json
+import time
+
+import redis
+
+from app import metrics
+
+registry = {}
+
+
+class LRUCache(object):
+    """
+    Per process LRU cache where every entry expires after `ttl` seconds.
+    """
+    def __init__(self, name, max_size, ttl):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+        registry[name] = self
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                metrics.CACHE_REQUESTS.labels(self.name, 'miss').inc()
+                return None
+            self.__entries[key] = entry
+            self.hits += 1
+            metrics.CACHE_REQUESTS.labels(self.name, 'hit').inc()
+            return entry[1]
+
+    def set(self, key, value):
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (time.time() + self.ttl, value)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.__entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class SharedCache(object):
+    """
+    Read-through cache of JSON values shared by all processes through Redis. Every Redis failure is taken as a miss
+    and Redis is left alone for `retry_after` seconds, so the callers just go to the database while it is down.
+    """
+    retry_after = 5
+
+    def __init__(self, name, client, ttl):
+        self.name = name
+        self.client = client
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.__down_until = 0
+        self.__lock = Lock()
+        registry[name] = self
+
+    @property
+    def is_available(self):
+        return self.client is not None and self.__down_until < time.time()
+
+    def __failed(self):
+        with self.__lock:
+            self.errors += 1
+        metrics.CACHE_REQUESTS.labels(self.name, 'error').inc()
+        self.__down_until = time.time() + self.retry_after
+
+    def get(self, key):
+        value = None
+        if self.is_available:
+            try:
+                value = self.client.get(key)
+            except redis.RedisError:
+                self.__failed()
+        if value is None:
+            with self.__lock:
+                self.misses += 1
+            metrics.CACHE_REQUESTS.labels(self.name, 'miss').inc()
+            return None
+        with self.__lock:
+            self.hits += 1
+        metrics.CACHE_REQUESTS.labels(self.name, 'hit').inc()
+        return json.loads(value)
+
+    def set(self, key, value):
+        if not self.is_available:
+            return
+        try:
+            self.client.setex(key, self.ttl, json.dumps(value))
+        except redis.RedisError:
+            self.__failed()
+
+    def delete(self, *keys):
+        if not self.is_available:
+            return
+        try:
+            self.client.delete(*keys)
+        except redis.RedisError:
+            self.__failed()
+
+    def get_or_set(self, key, load):
+        value = self.get(key)
+        if value is None:
+            value = load()
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+        }
+
+
+class FakeRedis(object):
+    """
+    In process stand in for the few Redis commands SharedCache uses, for tests and local runs without Redis
+    """
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value, expires_at = self.values.get(key, (None, None))
+        if expires_at is not None and expires_at < time.time():
+            del self.values[key]
+            return None
+        return value
+
+    def setex(self, key, ttl, value):
+        self.values[key] = (value, time.time() + ttl)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+def create_redis_client(redis_url, timeout=0.1):
+    if not redis_url:
+        return None
+    return redis.StrictRedis.from_url(redis_url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+
+def stats():
+    return {name: cache.stats() for name, cache in registry.items()}
@@ -16,14 +16,68 @@ class Config(object):
     CSRF_ENABLED = True
     AMBIENTE = None
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_BINDS = None
+    SQLALCHEMY_POOL_SIZE = 5
+    SQLALCHEMY_MAX_OVERFLOW = 10
+    SQLALCHEMY_POOL_TIMEOUT = 30
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLALCHEMY_POOL_PRE_PING = True
+    SQLALCHEMY_EXTERNAL_POOLER = False
+    DATABASE_MAX_CONNECTIONS = 20
+    UNIT_OF_WORK = True
+    SERVER_TIMING = True
+    QUERY_REPEAT_WARNING = 5
+    PROFILER_ENABLED = True
+    PROFILER_SAMPLE_RATE = 0.0
+    PROFILER_INTERVAL = 0.005
+    PROFILER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'profiles'))
+    CELERY_ALWAYS_EAGER = False
+    ROLLOVER_CHUNK_SIZE = 500
+    MONTH_JOB_MAX_MONTHS = 24
+    EAGER_RESULTS_SIZE = 1000
+    EAGER_RESULTS_TTL = 60 * 60
+    EXPIRING_DEBT_DAYS = 3
+    EXPIRING_DEBT_BATCH_SIZE = 500
+    EXPIRING_DEBT_NOTIFIER = 'app.notifiers.LogNotifier'
+    AUTH_CACHE_SIZE = 10000
+    AUTH_CACHE_TTL = 60
+    USER_LISTS_CACHE_TTL = 300
+    BULK_INSERT_BATCH_SIZE = 500
+    BULK_MAX_ERRORS = 100
+    # a JSON import is parsed whole in memory, bigger imports have to be sent as CSV, which is streamed
+    BULK_JSON_MAX_BYTES = 1024 * 1024
+    BULK_JSON_MAX_ROWS = 5000
+    BATCH_UPDATE_MAX_SIZE = 1000
+    EXPORT_BATCH_SIZE = 500
+    PASSWORD_SCHEMES = ['sha512_crypt', 'sha256_crypt']
+    PASSWORD_ROUNDS = 656000
+    HASHING_WORKERS = 2
+    HASHING_QUEUE_SIZE = 4
+    HASHING_TIMEOUT = 10
+    APM_ENABLED = True
+    STATUS_ENABLED = False
 
     def __init__(self):
         if self.AMBIENTE is None:
             raise TypeError('You should use one of the specialized config class')
         self.SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
+        if os.environ.get('DATABASE_REPLICA_URL'):
+            self.SQLALCHEMY_BINDS = {'replica': os.environ['DATABASE_REPLICA_URL']}
+        self.SQLALCHEMY_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', self.SQLALCHEMY_POOL_SIZE))
+        self.SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', self.SQLALCHEMY_MAX_OVERFLOW))
+        self.SQLALCHEMY_EXTERNAL_POOLER = os.environ.get('DATABASE_EXTERNAL_POOLER', str(self.SQLALCHEMY_EXTERNAL_POOLER)).lower() == 'true'
+        self.DATABASE_MAX_CONNECTIONS = int(os.environ.get('DATABASE_MAX_CONNECTIONS', self.DATABASE_MAX_CONNECTIONS))
         self.SECRET_KEY = os.environ['SECRET_KEY']
+        self.REDIS_URL = os.environ.get('REDIS_URL')
+        self.PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', str(self.PROFILER_ENABLED)).lower() == 'true'
+        self.PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+        self.PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', self.PROFILER_SAMPLE_RATE))
+        self.PROFILER_DIR = os.environ.get('PROFILER_DIR', self.PROFILER_DIR)
+        self.STATUS_ENABLED = os.environ.get('STATUS_ENABLED', str(self.STATUS_ENABLED)).lower() == 'true'
+        self.STATUS_TOKEN = os.environ.get('STATUS_TOKEN')
         self.ELASTIC_APM = {
             'SERVICE_NAME': 'scruminceres',
+            'ENABLED': self.APM_ENABLED,
             'SECRET_TOKEN': os.environ['APM_SECRET_TOKEN'],
             'SERVER_URL': os.environ['APM_SERVER_URL'],
             'ENVIRONMENT': self.AMBIENTE,
@@ -37,6 +91,9 @@ class ProductionConfig(Config):
     Production Config... this is the real thing
     """
     AMBIENTE = 'production'
+    SERVER_TIMING = False
+    QUERY_REPEAT_WARNING = None
+    PROFILER_ENABLED = False
 
 
 class StagingConfig(Config):
@@ -54,8 +111,11 @@ class DevelopmentConfig(Config):
     AMBIENTE = 'development'
     DEVELOPMENT = True
     DEBUG = True
+    SQLALCHEMY_POOL_SIZE = 2
+    SQLALCHEMY_MAX_OVERFLOW = 2
     SQLALCHEMY_RECORD_QUERIES = True
     SQLALCHEMY_ECHO = True
+    STATUS_ENABLED = True
 
 
 class SandboxConfig(Config):
@@ -65,6 +125,7 @@ class SandboxConfig(Config):
     AMBIENTE = 'sandbox'
     DEBUG = True
     SQLALCHEMY_RECORD_QUERIES = True
+    STATUS_ENABLED = True
 
 
 class TestingConfig(DevelopmentConfig):
@@ -74,6 +135,33 @@ class TestingConfig(DevelopmentConfig):
     AMBIENTE = 'test'
     TESTING = True
     KEY_ON_TEST = 'KEY ON TEST'
+    PASSWORD_ROUNDS = 1000
+    EXPIRING_DEBT_NOTIFIER = 'app.notifiers.MemoryNotifier'
+    CELERY_ALWAYS_EAGER = True
+    SQLALCHEMY_ECHO = False
+    APM_ENABLED = False
+
+
+DEFAULT_WORKER_THREADS = 4
+MAX_WORKER_THREADS = 16
+
+
+def web_concurrency(cpu_count, max_connections, external_pooler=False, workers=None, threads=None):
+    """
+    Sizes the gunicorn workers and their threads. Every thread holds at most one database connection,
+    so the pool of a worker has one connection per thread and workers * threads stays within `max_connections`,
+    also when `workers` or `threads` are given, unless an external pooler takes care of that limit.
+    Without `workers`, there are 2 * CPUs + 1; without `threads`, the connections are split between the workers.
+    :return A tuple with the workers and the threads of each one
+    :rtype: tuple
+    """
+    if workers is None:
+        workers = cpu_count * 2 + 1
+    if external_pooler:
+        return workers, threads or DEFAULT_WORKER_THREADS
+    if threads is None:
+        threads = max(min(max_connections // workers, MAX_WORKER_THREADS), 1)
+    return max(min(workers, max_connections // threads), 1), threads
 
 
 class ConfigClassNotFound(Exception):
@@ -83,12 +171,22 @@ class ConfigClassNotFound(Exception):
     pass
 
 
+loaded_config = None
+
+
 def get_config():
     """
-    Get the Config Class instance defined in APP_SETTINGS environment variable
+    Get the Config Class instance defined in APP_SETTINGS environment variable, built once per process
     :return The config class instance
     :rtype: Config
     """
+    global loaded_config
+    if loaded_config is None:
+        loaded_config = load_config()
+    return loaded_config
+
+
+def load_config():
     app_settings = os.environ.get('APP_SETTINGS', 'app.config.DevelopmentConfig')
     if app_settings == 'app.config.DevelopmentConfig':
         env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -1,5 +1,189 @@
 # -*- coding: utf-8 -*-
 
+from contextlib import contextmanager
+from threading import Lock
+from timeit import default_timer
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import exc, orm
+from sqlalchemy.pool import QueuePool, NullPool
+from sqlalchemy.sql.dml import UpdateBase
+
+from app import metrics
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool which counts the checkouts, the time spent waiting for a free connection and the checkout timeouts
+    """
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.__lock = Lock()
+
+    def _do_get(self):
+        start = default_timer()
+        timed_out = False
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = default_timer() - start
+            metrics.POOL_CHECKOUT_WAIT.observe(waited)
+            with self.__lock:
+                self.checkouts += 1
+                self.timeouts += int(timed_out)
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+    def stats(self):
+        return {
+            'size': self.size(),
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time,
+        }
+
+
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def has_replica(app):
+    return 'replica' in (app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session which reads from the replica bind once use_replica marked it, until it writes anything:
+    from then on everything goes to the primary, so the reads after a write see it
+    """
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        if self.info.get('replica') and not self.info.get('wrote') and has_replica(self.app):
+            return AppRepository.db.get_engine(self.app, bind='replica')
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class AppSQLAlchemy(SQLAlchemy):
+    """
+    Adds the pool options from the app config the Flask-SQLAlchemy version we use does not know about:
+    SQLALCHEMY_POOL_PRE_PING and SQLALCHEMY_EXTERNAL_POOLER, which leaves the pooling to a transaction mode
+    pooler (like PgBouncer) by opening a new connection for each checkout.
+    """
+    def apply_driver_hacks(self, app, info, options):
+        result = super(AppSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('sqlite'):
+            # SQLite picks its own pool, which does not take the queue pool sizes
+            for key in ('pool_size', 'pool_timeout', 'max_overflow'):
+                options.pop(key, None)
+            return result
+        if app.config.get('SQLALCHEMY_EXTERNAL_POOLER'):
+            options['poolclass'] = NullPool
+            for key in ('pool_size', 'pool_timeout', 'max_overflow'):
+                options.pop(key, None)
+        else:
+            options['poolclass'] = InstrumentedQueuePool
+        options['pool_pre_ping'] = app.config.get('SQLALCHEMY_POOL_PRE_PING', False)
+        return result
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 
 class AppRepository(object):
-    db = None
+    """
+    Holds the unbound SQLAlchemy object, so the models can be declared before there is an app to bind it with init_app
+    """
+    db = AppSQLAlchemy()
+
+
+def use_replica(session=None):
+    """
+    Sends the reads of the request session, or of `session`, to DATABASE_REPLICA_URL when there is one
+    """
+    if session is None:
+        session = AppRepository.db.session()
+    session.info['replica'] = True
+
+
+def begin_unit_of_work():
+    AppRepository.db.session().info['unit_of_work'] = True
+
+
+def end_unit_of_work(success):
+    """
+    Commits, or rolls back when not `success`, everything written since begin_unit_of_work.
+    The functions queued with after_commit only run once the commit went through.
+    """
+    session = AppRepository.db.session()
+    if not session.info.pop('unit_of_work', False):
+        return
+    callbacks = session.info.pop('after_commit', [])
+    if not success:
+        session.rollback()
+        return
+    try:
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    for function, args in callbacks:
+        function(*args)
+
+
+def after_commit(function, *args):
+    """
+    Calls `function` when the running unit of work commits, or right away when there is none,
+    so caches are not cleared before the rows they hold change, and filled again with the old ones
+    """
+    session = AppRepository.db.session()
+    if session.info.get('unit_of_work'):
+        session.info.setdefault('after_commit', []).append((function, args))
+    else:
+        function(*args)
+
+
+@contextmanager
+def unit_of_work():
+    begin_unit_of_work()
+    try:
+        yield
+    except Exception:
+        end_unit_of_work(False)
+        raise
+    end_unit_of_work(True)
+
+
+def commit():
+    """
+    Commits the session, or only flushes it when there is a unit of work running, which commits later
+    """
+    session = AppRepository.db.session()
+    if session.info.get('unit_of_work'):
+        session.flush()
+    else:
+        session.commit()
+
+
+def pool_stats():
+    pool = AppRepository.db.engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.stats()
+    return {'status': pool.status()}
+
+
+def dispose_connections(app):
+    """
+    Drops the connections inherited from the parent process, to call right after a fork
+    """
+    AppRepository.db.get_engine(app).dispose()
@@ -1,13 +1,37 @@
+import itertools
 import operator
 from datetime import datetime, date, timedelta
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 
 import jwt
-from passlib.apps import custom_app_context
+from flask import current_app
 
-from app import config as config_module, models
+from app import models, cache, hashing
 
-config = config_module.get_config()
+authenticated_users = None
+user_lists = None
+
+
+def init_app(app):
+    """
+    Builds the user caches from the config of `app`
+    """
+    global authenticated_users, user_lists
+    authenticated_users = cache.LRUCache('authenticated_users', app.config['AUTH_CACHE_SIZE'], app.config['AUTH_CACHE_TTL'])
+    user_lists = cache.SharedCache(
+        'user_lists',
+        cache.FakeRedis() if app.config['TESTING'] else cache.create_redis_client(app.config['REDIS_URL']),
+        app.config['USER_LISTS_CACHE_TTL']
+    )
+
+
+def debts_cache_key(user_id, data_version):
+    return 'watshodapay:users:{}:debts:{}'.format(user_id, data_version)
+
+
+def current_payments_cache_key(user_id, data_version):
+    # the payments status depends on the day, so each day has its own list
+    return 'watshodapay:users:{}:payments:{}:{}'.format(user_id, data_version, date.today().isoformat())
 
 
 class NotExist(Exception):
@@ -18,6 +42,12 @@ class AlreadyExist(Exception):
     pass
 
 
+class InvalidRows(Exception):
+    def __init__(self, errors):
+        super(InvalidRows, self).__init__('{} invalid rows'.format(len(errors)))
+        self.errors = errors
+
+
 class Entity(object):
     repository = None
 
@@ -30,8 +60,10 @@ class Entity(object):
         try:
             return cls(cls.repository.create_from_json(json_data))
         except cls.repository.RepositoryError as ex:
-            if 'already exists' in ex.message.lower:
+            message = ex.message.lower()
+            if 'already exists' in message or 'unique' in message:
                 raise AlreadyExist('Entity with {} already exists in repository'.format(json_data))
+            raise
 
     @classmethod
     def create_with_id(cls, entity_id):
@@ -80,8 +112,10 @@ class ValueObject(object):
         try:
             return cls(cls.repository.create_from_json(json_data))
         except cls.repository.RepositoryError as ex:
-            if 'already exists' in ex.message.lower:
+            message = ex.message.lower()
+            if 'already exists' in message or 'unique' in message:
                 raise cls.AlreadyExist('Entity with {} already exists in repository'.format(json_data))
+            raise
 
     @classmethod
     def create_with_instance(cls, instance):
@@ -113,6 +147,46 @@ class ValueObject(object):
 class UserDebt(ValueObject):
     repository = models.UserDebt
 
+    @staticmethod
+    def is_blank(value):
+        return value is None or (isinstance(value, basestring) and not value.strip())
+
+    @classmethod
+    def validate(cls, debt_data):
+        """
+        Validates and converts the debt data the same way create_a_deb does
+        :return A tuple with the debt values and a list of errors
+        :rtype: tuple
+        """
+        errors = []
+        debt = {}
+        description = debt_data.get('description')
+        if cls.is_blank(description):
+            errors.append('description is required')
+        else:
+            debt['description'] = description.strip()
+        try:
+            debt['expiration_day'] = int(debt_data.get('expiration_day'))
+            if not 1 <= debt['expiration_day'] <= 31:
+                errors.append('expiration_day must be between 1 and 31')
+        except (TypeError, ValueError):
+            errors.append('expiration_day must be a day of month')
+        value = debt_data.get('value')
+        try:
+            debt['value'] = Decimal(0 if cls.is_blank(value) else value).quantize(Decimal('0.01'))
+            if abs(debt['value']) >= 100000:
+                errors.append('value must be less than 100000')
+        except (TypeError, ValueError, InvalidOperation):
+            errors.append('value must be a number')
+        quantity = debt_data.get('quantity')
+        try:
+            debt['quantity'] = None if cls.is_blank(quantity) else int(quantity)
+            if debt['quantity'] is not None and debt['quantity'] < 0:
+                errors.append('quantity must not be negative')
+        except (TypeError, ValueError):
+            errors.append('quantity must be an integer')
+        return debt, errors
+
     @property
     def description(self):
         return self.instance.description
@@ -157,6 +231,46 @@ class UserDebt(ValueObject):
 
 class UserPayment(ValueObject):
     repository = models.UserPayment
+    statuses = ('payed', 'expired', 'today', 'tomorrow', 'opened')
+
+    @classmethod
+    def validate_patch(cls, patch_data):
+        """
+        Validates a payment patch, which has the payment id and any of is_payed, payment_info and value
+        :return A tuple with the patch values and a list of errors
+        :rtype: tuple
+        """
+        errors = []
+        patch = {}
+        if not isinstance(patch_data, dict):
+            return patch, ['patch must be an object']
+        payment_id = patch_data.get('id')
+        if isinstance(payment_id, bool) or not isinstance(payment_id, (int, long)):
+            errors.append('id must be a payment id')
+        patch['id'] = payment_id
+        for key in patch_data:
+            if key not in ('id', 'is_payed', 'payment_info', 'value'):
+                errors.append('{} can not be changed'.format(key))
+        if 'is_payed' in patch_data:
+            if not isinstance(patch_data['is_payed'], bool):
+                errors.append('is_payed must be true or false')
+            patch['is_payed'] = patch_data['is_payed']
+        if 'payment_info' in patch_data:
+            if patch_data['payment_info'] is not None and not isinstance(patch_data['payment_info'], basestring):
+                errors.append('payment_info must be a text')
+            patch['payment_info'] = patch_data['payment_info']
+        if 'value' in patch_data:
+            value = patch_data['value']
+            try:
+                if isinstance(value, bool):
+                    raise TypeError
+                patch['value'] = None if value is None else Decimal(value).quantize(Decimal('0.01'))
+                # the column is numeric(7, 2), a bigger value would fail the whole UPDATE
+                if patch['value'] is not None and abs(patch['value']) >= 100000:
+                    errors.append('value must be less than 100000')
+            except (TypeError, ValueError, InvalidOperation):
+                errors.append('value must be a number')
+        return patch, errors
 
     def __init__(self, instance):
         super(UserPayment, self).__init__(instance)
@@ -225,18 +339,30 @@ class User(Entity):
 
     @classmethod
     def create_new(cls, json_data):
-        json_data['password'] = custom_app_context.encrypt(json_data['password'])
-        super(User, cls).create_new(json_data)
+        json_data['password'] = hashing.hash_password(json_data['password'])
+        return super(User, cls).create_new(json_data)
 
     @classmethod
     def create_with_token(cls, token):
         try:
-            data = jwt.decode(token, config.SECRET_KEY)
+            data = jwt.decode(token, current_app.config['SECRET_KEY'])
         except Exception as ex:
             return None
         if not data.get('id', None):
             return None
-        return cls.create_with_id(data['id'])
+        identity = authenticated_users.get(data['id'])
+        if identity is not None:
+            return cls.create_with_identity(identity)
+        user = cls.create_with_id(data['id'])
+        authenticated_users.set(user.id, user.as_dict())
+        return user
+
+    @classmethod
+    def create_with_identity(cls, identity):
+        """
+        Creates a user from a cached identity. The repository instance is only loaded when something needs it.
+        """
+        return cls(None, identity)
 
     @classmethod
     def create_with_logged(cls, logged_user):
@@ -253,26 +379,49 @@ class User(Entity):
         instance = cls.repository.get_by_email(email)
         return cls.create_with_instance(instance)
 
-    def __init__(self, instance):
-        super(User, self).__init__(instance)
+    def __init__(self, instance, identity=None):
+        self.__instance = instance
+        self.__identity = identity
+        self.id = identity['id'] if instance is None else instance.id
         self.temp_password = None
         self.__debts = None
         self.__current_payments = None
 
+    @property
+    def instance(self):
+        if self.__instance is None:
+            self.__instance = self.repository.get(self.id)
+        return self.__instance
+
+    def update_me(self, json_data):
+        super(User, self).update_me(json_data)
+        self.__identity = None
+        models.after_commit(authenticated_users.invalidate, self.id)
+
+    @property
+    def data_version(self):
+        return self.repository.get_data_version(self.id)
+
     @property
     def password_hash(self):
         return self.instance.password
 
-    @property
     def is_correct(self):
-        return custom_app_context.verify(self.temp_password, self.password_hash)
+        correct, new_hash = hashing.verify_and_update(self.temp_password, self.password_hash)
+        if correct and new_hash is not None:
+            self.update_me({'password': new_hash})
+        return correct
 
     @property
     def name(self):
+        if self.__identity is not None:
+            return self.__identity['name']
         return self.instance.name
 
     @property
     def email(self):
+        if self.__identity is not None:
+            return self.__identity['email']
         return self.instance.email
 
     @property
@@ -289,6 +438,36 @@ class User(Entity):
             self.__debts = UserDebt.list_all(self.instance.debts)
         return self.__debts
 
+    # The user lists are cached under the data version read before them, from the same database. Every write
+    # bumps the version, so it never has to clear them, and a list read from a lagging replica is only
+    # served to the requests which see that same version.
+    def current_payments_as_dict(self):
+        return user_lists.get_or_set(
+            current_payments_cache_key(self.id, self.data_version),
+            lambda: [payment.as_dict() for payment in self.current_payments]
+        )
+
+    def debts_as_dict(self):
+        return user_lists.get_or_set(
+            debts_cache_key(self.id, self.data_version),
+            lambda: [debt.as_dict() for debt in self.debts]
+        )
+
+    # the exports only need the user id, so the users row is not loaded again while the response streams
+    def stream_debts(self):
+        for instance in self.repository.stream_debts(self.id, current_app.config['EXPORT_BATCH_SIZE']):
+            yield UserDebt.create_with_instance(instance)
+
+    def stream_payments(self):
+        for instance in self.repository.stream_payments(self.id, current_app.config['EXPORT_BATCH_SIZE']):
+            yield UserPayment.create_with_instance(instance)
+
+    def list_debts_after(self, limit, after=None):
+        return UserDebt.list_all(self.instance.debts_after(limit, after))
+
+    def list_payments_after(self, limit, after=None):
+        return UserPayment.list_all(self.instance.payments_after(limit, after))
+
     def get_debt(self, debt_id):
         return UserDebt.create_with_instance(self.instance.get_debt(debt_id))
 
@@ -302,6 +481,40 @@ class User(Entity):
         self.__debts = None
         return debt
 
+    def import_debts(self, debts_data):
+        """
+        Validates and inserts the debts, in batches of multi-row INSERTs, all in one transaction.
+        `debts_data` can be any iterable, so the rows are never all in memory.
+        If any row is invalid nothing is created and InvalidRows has the errors of the first rows.
+        :return The number of debts created
+        :rtype: int
+        """
+        errors = []
+
+        def valid_batches():
+            batch = []
+            for number, debt_data in enumerate(debts_data, 1):
+                debt, debt_errors = UserDebt.validate(debt_data)
+                if debt_errors:
+                    errors.append({'row': number, 'errors': debt_errors})
+                    if len(errors) >= current_app.config['BULK_MAX_ERRORS']:
+                        break
+                if errors:
+                    continue
+                debt['user_id'] = self.id
+                batch.append(debt)
+                if len(batch) == current_app.config['BULK_INSERT_BATCH_SIZE']:
+                    yield batch
+                    batch = []
+            if errors:
+                raise InvalidRows(errors)
+            if batch:
+                yield batch
+
+        created = UserDebt.repository.insert_many(valid_batches())
+        self.__debts = None
+        return created
+
     def create_payment(self, payment_data):
         if payment_data.get('single'):
             self.remove_unused_json_data_key('single', payment_data)
@@ -311,6 +524,21 @@ class User(Entity):
         month = payment_data.get('month', today.month)
         self.create_month_payments(year, month)
 
+    def month_payments_job(self, payment_data):
+        """
+        Reads the arguments of a job which generates `months` months of payments, starting at year and month
+        :return The year, the month and the number of months
+        :rtype: tuple
+        """
+        today = date.today()
+        year = int(payment_data.get('year', today.year))
+        month = int(payment_data.get('month', today.month))
+        months = int(payment_data.get('months', 1))
+        max_months = current_app.config['MONTH_JOB_MAX_MONTHS']
+        if not 1 <= month <= 12 or not 1 <= months <= max_months:
+            raise ValueError('month must be between 1 and 12 and months between 1 and {}'.format(max_months))
+        return year, month, months
+
     def create_a_single_payment(self, payment_data, debt=None):
         if debt is None:
             debt_data = payment_data.pop('debt')
@@ -327,6 +555,12 @@ class User(Entity):
         return payment
 
     def create_month_payments(self, year, month):
+        created = self.instance.create_month_payments(year, month)
+        self.__debts = None
+        self.__current_payments = None
+        return created
+
+    def create_month_payments_per_debt(self, year, month):
         for debt in self.debts:
             if debt.is_active or debt.is_recurrent:
                 if self.payment_not_registerd_yet(debt.id, year, month):
@@ -337,16 +571,80 @@ class User(Entity):
     def update_debt(self, debt_id, debt_data):
         debt = self.get_debt(debt_id)
         debt.update_me(debt_data)
+        self.__debts = None
+        self.__current_payments = None
         return debt
 
     def update_payment(self, payment_id, payment_data):
         payment = self.get_payment(payment_id)
         payment.update_me(payment_data)
+        self.__current_payments = None
         return payment
 
+    def update_payments(self, patches_data):
+        """
+        Applies a list of payment patches with one ownership check and one UPDATE, in the same transaction
+        :return The payments the patches changed
+        :rtype: list
+        """
+        max_size = current_app.config['BATCH_UPDATE_MAX_SIZE']
+        if len(patches_data) > max_size:
+            raise ValueError('Send at most {} payments'.format(max_size))
+        patches = []
+        errors = []
+        seen_ids = set()
+        for number, patch_data in enumerate(patches_data, 1):
+            patch, patch_errors = UserPayment.validate_patch(patch_data)
+            if not patch_errors and patch['id'] in seen_ids:
+                patch_errors.append('payment {} is repeated'.format(patch['id']))
+            if patch_errors:
+                errors.append({'row': number, 'errors': patch_errors})
+                continue
+            seen_ids.add(patch['id'])
+            patches.append(patch)
+        if errors:
+            raise InvalidRows(errors)
+        if not patches:
+            return []
+        missing_ids = seen_ids - UserPayment.repository.owned_ids(self.id, seen_ids)
+        if missing_ids:
+            raise NotExist('Payments {} do not exist'.format(', '.join(str(payment_id) for payment_id in sorted(missing_ids))))
+        changed_ids = UserPayment.repository.update_many(self.id, patches)
+        if not changed_ids:
+            return []
+        self.__current_payments = None
+        return UserPayment.list_all(UserPayment.repository.list_with_debts(changed_ids))
+
     def list_payments_for(self, year, month):
         return UserPayment.list_all(self.instance.filter_payments(year, month))
 
+    def payments_summary(self, year, month):
+        statuses = {status: {'count': 0, 'value': 0.0} for status in UserPayment.statuses}
+        for status, count, value in self.instance.payments_summary(year, month, date.today().day):
+            statuses[status] = {'count': count, 'value': float(value)}
+        total_value = sum(status['value'] for status in statuses.values())
+        return {
+            'year': year,
+            'month': month,
+            'count': sum(status['count'] for status in statuses.values()),
+            'value': total_value,
+            'payed_value': statuses['payed']['value'],
+            'owed_value': total_value - statuses['payed']['value'],
+            'statuses': statuses
+        }
+
+    def list_payments_by_month(self, first_month, last_month):
+        """
+        Lists the payments from the (year, month) `first_month` to the (year, month) `last_month` with one query
+        :return A list of ((year, month), payments) sorted by month, with each month payments sorted by date
+        :rtype: list
+        """
+        payments = UserPayment.list_all(self.instance.payments_between(first_month, last_month))
+        by_month = []
+        for year_month, month_payments in itertools.groupby(payments, key=operator.attrgetter('year', 'month')):
+            by_month.append((year_month, sorted(month_payments, key=operator.attrgetter('date'))))
+        return by_month
+
     def as_dict(self, compact=False):
         return {
             'id': self.id,
@@ -354,12 +652,24 @@ class User(Entity):
             'name': self.name,
         }
 
+    def reload_identity(self):
+        """
+        Reads the identity again from the users row and caches it. The cached one is only invalidated
+        in the process which changed the user, so it can be older than the data version of the row.
+        :return The user as a dict
+        :rtype: dict
+        """
+        self.__identity = None
+        identity = self.as_dict()
+        authenticated_users.set(self.id, identity)
+        return identity
+
     def generate_auth_token(self, expiration=600):
         token_data = self.as_dict()
         token_data.update({
             'exp': datetime.utcnow() + timedelta(minutes=expiration)
         })
-        return jwt.encode(token_data, config.SECRET_KEY, algorithm='HS256')
+        return jwt.encode(token_data, current_app.config['SECRET_KEY'], algorithm='HS256')
 
     def payment_not_registerd_yet(self, debt_id, year, month):
         return not self.instance.payment_exists(debt_id, year, month)
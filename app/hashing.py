@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from multiprocessing import Pool, TimeoutError
+from threading import BoundedSemaphore, Lock
+from timeit import default_timer
+import os
+
+from passlib.context import CryptContext
+
+from app import metrics
+
+
+class HashingBusy(Exception):
+    """
+    Raises when there are already HASHING_QUEUE_SIZE hashes running or waiting in the hashing pool of this process,
+    or when a hash waited more than HASHING_TIMEOUT seconds
+    """
+    pass
+
+
+def create_context(schemes, rounds):
+    settings = {}
+    for scheme in schemes:
+        settings['{}__default_rounds'.format(scheme)] = rounds
+        settings['{}__min_rounds'.format(scheme)] = rounds
+        settings['{}__max_rounds'.format(scheme)] = rounds
+    return CryptContext(schemes=schemes, default=schemes[0], deprecated=['auto'], **settings)
+
+
+def run_operation(operation, args):
+    """
+    Runs the `operation` method of the module context in a pool process
+    :return A tuple with the result and the seconds it took
+    :rtype: tuple
+    """
+    start = default_timer()
+    result = getattr(context, operation)(*args)
+    return result, default_timer() - start
+
+
+class HashingPool(object):
+    """
+    Runs the password hashing in a bounded pool of processes. crypt() holds the GIL, and passlib a global lock around it,
+    so a thread would still stop every other request thread of the worker. The pool is created after the fork,
+    by start() in the gunicorn post_fork hook or on first use, so each web worker has its own processes.
+    The queue limit is per web worker: with threaded workers, the logins over it get HashingBusy instead of waiting.
+    """
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.total_time = 0.0
+        self.hashes = 0
+        self.__slots = BoundedSemaphore(queue_size)
+        self.__lock = Lock()
+        self.__pool = None
+        self.__pid = None
+
+    def start(self):
+        with self.__lock:
+            if self.__pool is None or self.__pid != os.getpid():
+                self.__pool = Pool(self.workers)
+                self.__pid = os.getpid()
+            return self.__pool
+
+    def run(self, operation, *args):
+        if not self.__slots.acquire(False):
+            metrics.HASHING_REJECTED.inc()
+            raise HashingBusy('Password hashing queue is full')
+        try:
+            result, duration = self.start().apply_async(run_operation, (operation, args)).get(self.timeout)
+        except TimeoutError:
+            metrics.HASHING_REJECTED.inc()
+            raise HashingBusy('Password hashing took more than {} seconds'.format(self.timeout))
+        finally:
+            self.__slots.release()
+        metrics.HASHING_DURATION.labels(operation).observe(duration)
+        with self.__lock:
+            self.total_time += duration
+            self.hashes += 1
+        return result
+
+
+context = None
+pool = None
+
+
+def init_app(app):
+    """
+    Builds the hashing context and pool from the config of `app`. The pool processes only start on first use
+    """
+    global context, pool
+    context = create_context(app.config['PASSWORD_SCHEMES'], app.config['PASSWORD_ROUNDS'])
+    pool = HashingPool(app.config['HASHING_WORKERS'], app.config['HASHING_QUEUE_SIZE'], app.config['HASHING_TIMEOUT'])
+
+
+def hash_password(password):
+    return pool.run('hash', password)
+
+
+def verify_and_update(password, password_hash):
+    """
+    Verifies the password and, when the hash was made with another scheme or cost, returns its new hash
+    :return A tuple with the verification result and the new hash or None
+    :rtype: tuple
+    """
+    return pool.run('verify_and_update', password, password_hash)
@@ -1,13 +1,9 @@
-import json
+import os
 
-from flask import Response
+from app.initialize import create_app
 
-from app.initialize import web_app, run
-from app import api
+web_app = create_app()
 
-api.create_api(web_app)
 
-
-@web_app.route('/')
-def root():
-    return Response(json.dumps({'result': 'OK'}), content_type='application/json')
+def run():
+    web_app.run(host='0.0.0.0', port=int(os.environ.get('PORTA', 3666)), debug=True)
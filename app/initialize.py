@@ -1,24 +1,80 @@
 # -*- coding: utf-8 -*-
 
-import os
+import hmac
+import json
+from timeit import default_timer
 
-from flask import Flask, g, request
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, g, request, current_app, abort
 
-from app import config as config_module, api, database, auth, apm
+from app import config as config_module, api, database, auth, apm, instrumentation, profiler, metrics, cache
 
-config = config_module.get_config()
 
-web_app = Flask(__name__)
-web_app.config.from_object(config)
-apm.create_monitor(web_app)
+def create_app(config=None):
+    """
+    Creates the web app with every resource, hook and status route registered once.
+    Nothing here opens a connection or starts a thread, so the app can be created in the gunicorn master with --preload
+    and shared by the forked workers.
+    :return The web app
+    :rtype: Flask
+    """
+    if config is None:
+        config = config_module.get_config()
+    app = Flask(__name__)
+    app.config.from_object(config)
+    apm.create_monitor(app)
+    database.AppRepository.db.init_app(app)
+    init_services(app)
+    api.create_api(app)
+    metrics.init_app(app)
+    if config.PROFILER_ENABLED:
+        profiler.RequestProfiler(app)
+    for hook in (start_request_timer, route_reads_to_replica, begin_unit_of_work, before_request):
+        app.before_request(hook)
+    for hook in (end_unit_of_work, add_cache_header, add_access_control_header, add_token_header, add_server_timing_header):
+        app.after_request(hook)
+    app.teardown_request(discard_unit_of_work)
+    app.add_url_rule('/', 'root', root)
+    if config.STATUS_ENABLED:
+        app.add_url_rule('/stats', 'stats', stats)
+        app.add_url_rule('/metrics', 'metrics', prometheus_metrics)
+    return app
+
+
+def init_services(app):
+    """
+    Builds the hashing pool and the user caches from the app config and binds the worker tasks to the app. They are
+    imported here, not with this module, so importing it stays cheap for the tools which never create the app.
+    """
+    from app import domain, hashing, worker
+    hashing.init_app(app)
+    domain.init_app(app)
+    worker.init_app(app)
+
+
+def start_request_timer():
+    g.request_started_at = default_timer()
+
+
+def route_reads_to_replica():
+    if request.method in database.READ_ONLY_METHODS:
+        database.use_replica()
+
+
+def begin_unit_of_work():
+    if current_app.config.get('UNIT_OF_WORK'):
+        database.begin_unit_of_work()
+
+
+def end_unit_of_work(response):
+    database.end_unit_of_work(response.status_code < 400)
+    return response
 
-database.AppRepository.db = SQLAlchemy(web_app)
 
-api.create_api(web_app)
+def discard_unit_of_work(exception):
+    if exception is not None:
+        database.end_unit_of_work(False)
 
 
-@web_app.before_request
 def before_request():
     token = request.headers.get('XSRF-TOKEN', None)
     authenticated = None
@@ -35,15 +91,16 @@ def before_request():
     g.authenticated = authenticated
 
 
-@web_app.after_request
 def add_cache_header(response):
+    if 'ETag' in response.headers:
+        response.headers['Cache-Control'] = "private, no-cache"
+        return response
     response.headers['Cache-Control'] = "no-cache, no-store, must-revalidate"
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     return response
 
 
-@web_app.after_request
 def add_access_control_header(response):
     """
     Add response headers for CORS
@@ -57,7 +114,6 @@ def add_access_control_header(response):
     return response
 
 
-@web_app.after_request
 def add_token_header(response):
     user = g.get("user")
     if user is not None:
@@ -66,5 +122,43 @@ def add_token_header(response):
     return response
 
 
-def run():
-    web_app.run(host='0.0.0.0', port=int(os.environ.get('PORTA', 3666)), debug=True)
+def add_server_timing_header(response):
+    recorder = g.get('query_recorder')
+    if recorder is None:
+        recorder = instrumentation.QueryRecorder()
+    repeat_warning = current_app.config.get('QUERY_REPEAT_WARNING')
+    shape, repeats = recorder.most_repeated
+    if repeat_warning and repeats > repeat_warning:
+        current_app.logger.warning('Possible N+1 in %s %s: statement ran %s times: %s', request.method, request.path, repeats, shape)
+    if current_app.config.get('SERVER_TIMING'):
+        response.headers['Server-Timing'] = 'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(
+            recorder.time * 1000, recorder.count, (default_timer() - g.get('request_started_at', default_timer())) * 1000
+        )
+    return response
+
+
+def root():
+    return Response(json.dumps({'result': 'OK'}), content_type='application/json')
+
+
+def check_status_token():
+    """
+    With STATUS_TOKEN set, /stats and /metrics answer only the requests with an `Authorization: Bearer <token>`
+    header, which is what Prometheus sends with `bearer_token` in the scrape config
+    """
+    token = current_app.config.get('STATUS_TOKEN')
+    if not token:
+        return
+    authorization = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(str(authorization), str('Bearer {}'.format(token))):
+        abort(401)
+
+
+def stats():
+    check_status_token()
+    return Response(json.dumps({'caches': cache.stats(), 'database_pool': database.pool_stats()}), content_type='application/json')
+
+
+def prometheus_metrics():
+    check_status_token()
+    return metrics.exposition()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from contextlib import contextmanager
+from timeit import default_timer
+import re
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PARAMETERS = re.compile(r'%\(\w+\)s|\?|:\w+')
+PARAMETER_LISTS = re.compile(r'\?(\s*,\s*\?)+')
+SPACES = re.compile(r'\s+')
+
+recorders = []
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder(object):
+    """
+    Counts the queries, the time spent on them and, with `track_shapes`, how many times each statement shape ran
+    """
+    def __init__(self, track_shapes=True):
+        self.count = 0
+        self.time = 0.0
+        self.track_shapes = track_shapes
+        self.shapes = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.time += duration
+        if self.track_shapes:
+            self.shapes[statement_shape(statement)] += 1
+
+    @property
+    def most_repeated(self):
+        if not self.shapes:
+            return None, 0
+        return self.shapes.most_common(1)[0]
+
+
+def statement_shape(statement):
+    """
+    The statement without its parameters, with IN lists of any size collapsed, so the same query always has the same shape
+    """
+    shape = PARAMETERS.sub('?', statement)
+    shape = PARAMETER_LISTS.sub('?', shape)
+    return SPACES.sub(' ', shape).strip()
+
+
+def request_recorder():
+    """
+    The recorder of the current request, only when SERVER_TIMING or QUERY_REPEAT_WARNING needs it.
+    The statement shapes are only worked out for QUERY_REPEAT_WARNING.
+    """
+    if not has_app_context():
+        return None
+    recorder = g.get('query_recorder')
+    if recorder is None:
+        repeat_warning = bool(current_app.config.get('QUERY_REPEAT_WARNING'))
+        if not repeat_warning and not current_app.config.get('SERVER_TIMING'):
+            return None
+        recorder = g.query_recorder = QueryRecorder(track_shapes=repeat_warning)
+    return recorder
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context, so a statement which fails leaves nothing behind on the connection
+    if context is not None:
+        context._query_started_at = default_timer()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, '_query_started_at', None)
+    if started_at is None:
+        return
+    duration = default_timer() - started_at
+    recorder = request_recorder()
+    if recorder is not None:
+        recorder.record(statement, duration)
+    for recorder in recorders:
+        recorder.record(statement, duration)
+
+
+@contextmanager
+def query_budget(max_queries=None, max_repeats=None):
+    """
+    Fails with QueryBudgetExceeded when the block runs more than `max_queries` queries,
+    or the same statement shape more than `max_repeats` times, like an N+1 does. To use in tests:
+
+        with query_budget(max_queries=4, max_repeats=1):
+            client.get('/api/me/payments', headers=headers)
+    """
+    recorder = QueryRecorder()
+    recorders.append(recorder)
+    try:
+        yield recorder
+    finally:
+        recorders.remove(recorder)
+    if max_queries is not None and recorder.count > max_queries:
+        raise QueryBudgetExceeded('{} queries ran, the budget is {}'.format(recorder.count, max_queries))
+    shape, repeats = recorder.most_repeated
+    if max_repeats is not None and repeats > max_repeats:
+        raise QueryBudgetExceeded('Statement ran {} times, the budget is {}: {}'.format(repeats, max_repeats, shape))
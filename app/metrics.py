@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from timeit import default_timer
+import os
+
+from flask import g, request, Response
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+REQUEST_DURATION = Histogram(
+    'watshodapay_request_duration_seconds', 'Request latency by resource and method', ['resource', 'method']
+)
+RESPONSES = Counter(
+    'watshodapay_responses_total', 'Responses by resource, method and status code', ['resource', 'method', 'status']
+)
+REQUEST_DB_TIME = Histogram(
+    'watshodapay_request_db_seconds', 'Database time per request by resource', ['resource'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, float('inf'))
+)
+REQUEST_QUERIES = Histogram(
+    'watshodapay_request_queries', 'Queries per request by resource', ['resource'],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float('inf'))
+)
+CACHE_REQUESTS = Counter('watshodapay_cache_requests_total', 'Cache lookups by cache and result', ['cache', 'result'])
+HASHING_DURATION = Histogram(
+    'watshodapay_password_hashing_seconds', 'Password hashing and verification time', ['operation'],
+    buckets=(.01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, float('inf'))
+)
+HASHING_REJECTED = Counter('watshodapay_password_hashing_rejected_total', 'Hashings rejected because the queue was full')
+POOL_CHECKOUT_WAIT = Histogram(
+    'watshodapay_db_pool_checkout_wait_seconds', 'Time waiting for a database connection from the pool',
+    buckets=(.0001, .001, .005, .01, .05, .1, .5, 1.0, 5.0, float('inf'))
+)
+
+
+def resource_name():
+    return request.endpoint or 'not_found'
+
+
+def start_timer():
+    g.metrics_started_at = default_timer()
+
+
+def observe_request(response):
+    started_at = g.get('metrics_started_at')
+    if started_at is None:
+        return response
+    resource = resource_name()
+    REQUEST_DURATION.labels(resource, request.method).observe(default_timer() - started_at)
+    RESPONSES.labels(resource, request.method, str(response.status_code)).inc()
+    recorder = g.get('query_recorder')
+    if recorder is not None:
+        REQUEST_DB_TIME.labels(resource).observe(recorder.time)
+        REQUEST_QUERIES.labels(resource).observe(recorder.count)
+    return response
+
+
+def registry():
+    """
+    With gunicorn, set prometheus_multiproc_dir to an empty directory before the app starts,
+    so every worker writes its metrics there and any of them answers /metrics with the sum of all.
+    """
+    multiprocess_dir = os.environ.get('prometheus_multiproc_dir') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not multiprocess_dir:
+        return REGISTRY
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry, path=multiprocess_dir)
+    return collector_registry
+
+
+def exposition():
+    return Response(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    app.before_request(start_timer)
+    app.after_request(observe_request)
@@ -1,13 +1,27 @@
 #  -*- coding: utf-8 -*-
 
-from sqlalchemy import exc
-from sqlalchemy.orm import relationship
+from sqlalchemy import exc, and_, or_, select, literal, func, tuple_, case, text, exists
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import relationship, joinedload
 
 from app import database
 
 db = database.AppRepository.db
 
 
+def insert_ignoring_conflicts(table, index_elements):
+    """
+    Creates an INSERT for `table` which skips the rows conflicting with the unique `index_elements`
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    return table.insert().prefix_with('OR IGNORE')
+
+
+def after_commit(function, *args):
+    database.after_commit(function, *args)
+
+
 class AbstractModel(object):
     class NotExist(Exception):
         pass
@@ -25,6 +39,41 @@ class AbstractModel(object):
         except exc.IntegrityError as ex:
             raise cls.RepositoryError(ex.message)
 
+    @classmethod
+    def insert_many(cls, batches):
+        """
+        Inserts each batch of rows with one multi-row INSERT, all in the same transaction
+        :return The number of rows inserted
+        :rtype: int
+        """
+        inserted = 0
+        owner_ids = set()
+        try:
+            for batch in batches:
+                db.session.execute(cls.__table__.insert().values(batch))
+                inserted += len(batch)
+                owner_ids.update(row['user_id'] for row in batch)
+            for owner_id in owner_ids:
+                User.bump_data_version(owner_id)
+            database.commit()
+            return inserted
+        except exc.IntegrityError as ex:
+            db.session.rollback()
+            raise cls.RepositoryError(ex.message)
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def stream_with_filter(cls, order_by, batch_size, **kwargs):
+        """
+        Yields the instances read in batches from a server side cursor. The query runs on the request session,
+        which the unit of work already committed when the response streams, so an export holds one connection.
+        """
+        query = db.session.query(cls).filter_by(**kwargs).order_by(*order_by)
+        for instance in query.execution_options(stream_results=True).yield_per(batch_size):
+            yield instance
+
     @classmethod
     def list_with_filter(cls, **kwargs):
         return cls.query.filter_by(**kwargs).all()
@@ -45,14 +94,24 @@ class AbstractModel(object):
         else:
             return item
 
+    @property
+    def owner_id(self):
+        return self.user_id
+
+    def bump_owner_version(self):
+        if self.owner_id is not None:
+            User.bump_data_version(self.owner_id)
+
     def save_db(self):
         db.session.add(self)
-        db.session.commit()
+        self.bump_owner_version()
+        database.commit()
 
     def delete_db(self):
         try:
+            self.bump_owner_version()
             db.session.delete(self)
-            db.session.commit()
+            database.commit()
         except exc.IntegrityError as ex:
             raise self.RepositoryError(ex.message)
 
@@ -75,6 +134,7 @@ class User(db.Model, AbstractModel):
     email = db.Column(db.String(), nullable=False, unique=True)
     password = db.Column(db.String(128), nullable=False)
     name = db.Column(db.String(), nullable=False)
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     debts = relationship('UserDebt', lazy='dynamic', order_by='UserDebt.expiration_day', back_populates='user', passive_deletes=True)
     payments = relationship('UserPayment', lazy='dynamic', order_by='-UserPayment.year,UserPayment.month', back_populates='user', passive_deletes=True)
 
@@ -82,12 +142,158 @@ class User(db.Model, AbstractModel):
     def get_by_email(cls, email):
         return cls.get_with_filter(email=email)
 
+    @classmethod
+    def get_data_version(cls, user_id):
+        return db.session.query(cls.data_version).filter(cls.id == user_id).scalar()
+
+    @classmethod
+    def bump_data_version(cls, user_id):
+        """
+        Increments the version of all data of the user. It runs in the current transaction, so it commits with the write.
+        """
+        users = cls.__table__
+        db.session.execute(users.update().where(users.c.id == user_id).values(data_version=users.c.data_version + 1))
+
+    @property
+    def owner_id(self):
+        return self.id
+
+    @classmethod
+    def id_range(cls):
+        return db.session.query(func.min(cls.id), func.max(cls.id)).one()
+
+    @classmethod
+    def list_in_id_range(cls, first_id, last_id):
+        return cls.query.filter(cls.id >= first_id, cls.id <= last_id).order_by(cls.id).all()
+
     def filter_payments(self, year, month):
         return self.payments.filter_by(year=year, month=month)
 
     def payment_exists(self, debt_id, year, month):
         return self.payments.filter_by(user_debt_id=debt_id, year=year, month=month).count() > 0
 
+    def create_month_payments(self, year, month):
+        """
+        Creates the missing payments of all active or recurrent debts for the month and decreases the quantity
+        of the debts which got a payment, committing both in a single transaction. The payments already registered
+        are skipped, and so is the quantity of their debts, so running it again for the same month changes nothing.
+        :return The number of payments created
+        :rtype: int
+        """
+        debts = UserDebt.__table__
+        payments = UserPayment.__table__
+        columns = ['year', 'month', 'value', 'user_id', 'user_debt_id']
+        month_payments = select([
+            literal(year, type_=db.Integer),
+            literal(month, type_=db.Integer),
+            func.coalesce(debts.c.value, 0),
+            debts.c.user_id,
+            debts.c.id
+        ]).where(and_(
+            debts.c.user_id == self.id,
+            or_(debts.c.quantity.is_(None), debts.c.quantity > 0)
+        ))
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                created = db.session.execute(
+                    postgresql.insert(payments).from_select(columns, month_payments).on_conflict_do_nothing(
+                        index_elements=['user_debt_id', 'year', 'month']
+                    ).returning(payments.c.user_debt_id)
+                )
+                debt_ids = [row[0] for row in created]
+            else:
+                debt_ids = self.__debts_without_payment(month_payments, year, month)
+                if debt_ids:
+                    db.session.execute(
+                        insert_ignoring_conflicts(payments, ['user_debt_id', 'year', 'month']).from_select(
+                            columns, month_payments.where(debts.c.id.in_(debt_ids))
+                        )
+                    )
+            if debt_ids:
+                db.session.execute(
+                    debts.update().where(and_(debts.c.id.in_(debt_ids), debts.c.quantity > 0)).values(quantity=debts.c.quantity - 1)
+                )
+                self.bump_data_version(self.id)
+            database.commit()
+            return len(debt_ids)
+        except exc.IntegrityError as ex:
+            db.session.rollback()
+            raise self.RepositoryError(ex.message)
+
+    @staticmethod
+    def __debts_without_payment(month_payments, year, month):
+        """
+        Ids of the debts of `month_payments` without a payment for the month, for the databases without INSERT ... RETURNING
+        """
+        debts = UserDebt.__table__
+        payments = UserPayment.__table__
+        has_payment = exists().where(and_(
+            payments.c.user_debt_id == debts.c.id,
+            payments.c.year == year,
+            payments.c.month == month
+        ))
+        query = month_payments.with_only_columns([debts.c.id]).where(~has_payment)
+        return [row[0] for row in db.session.execute(query)]
+
+    def debts_after(self, limit, after=None):
+        query = UserDebt.query.filter(UserDebt.user_id == self.id)
+        if after is not None:
+            query = query.filter(tuple_(UserDebt.expiration_day, UserDebt.id) > tuple_(*after))
+        return query.order_by(UserDebt.expiration_day, UserDebt.id).limit(limit).all()
+
+    def payments_after(self, limit, after=None):
+        query = UserPayment.query.filter(UserPayment.user_id == self.id)
+        if after is not None:
+            query = query.filter(tuple_(UserPayment.year, UserPayment.month, UserPayment.id) > tuple_(*after))
+        return query.order_by(UserPayment.year, UserPayment.month, UserPayment.id).limit(limit).all()
+
+    def payments_between(self, first_month, last_month):
+        """
+        Lists the payments, with their debts, from the (year, month) `first_month` to the (year, month) `last_month`
+        """
+        year_month = tuple_(UserPayment.year, UserPayment.month)
+        return UserPayment.query.options(joinedload(UserPayment.user_debt)).filter(
+            UserPayment.user_id == self.id,
+            year_month >= tuple_(*first_month),
+            year_month <= tuple_(*last_month)
+        ).order_by(UserPayment.year, UserPayment.month, UserPayment.id).all()
+
+    def payments_summary(self, year, month, today):
+        """
+        Counts and sums the month payments grouped by the same status rules of domain.UserPayment.status,
+        where `today` is the day of month used to tell expired, today and tomorrow payments.
+        :return A list of (status, count, value) rows
+        :rtype: list
+        """
+        debts = UserDebt.__table__
+        payments = UserPayment.__table__
+        status = case([
+            (payments.c.is_payed.is_(True), literal('payed')),
+            (debts.c.expiration_day < today, literal('expired')),
+            (debts.c.expiration_day == today, literal('today')),
+            (debts.c.expiration_day == today + 1, literal('tomorrow')),
+        ], else_=literal('opened')).label('status')
+        query = select([
+            status,
+            func.count(payments.c.id),
+            func.coalesce(func.sum(payments.c.value), 0)
+        ]).select_from(
+            payments.join(debts, payments.c.user_debt_id == debts.c.id)
+        ).where(and_(
+            payments.c.user_id == self.id,
+            payments.c.year == year,
+            payments.c.month == month
+        )).group_by(status)
+        return db.session.execute(query).fetchall()
+
+    @classmethod
+    def stream_debts(cls, user_id, batch_size):
+        return UserDebt.stream_with_filter((UserDebt.expiration_day, UserDebt.id), batch_size, user_id=user_id)
+
+    @classmethod
+    def stream_payments(cls, user_id, batch_size):
+        return UserPayment.stream_with_filter((UserPayment.year, UserPayment.month, UserPayment.id), batch_size, user_id=user_id)
+
     def get_debt(self, debt_id):
         return self.debts.filter_by(debt_id).first()
 
@@ -97,6 +303,9 @@ class User(db.Model, AbstractModel):
 
 class UserDebt(db.Model, AbstractModel):
     __tablename__ = 'users_debts'
+    __table_args__ = (
+        db.Index('ix_users_debts_user_id_expiration_day_id', 'user_id', 'expiration_day', 'id'),
+    )
     __mapper_args__ = {
         "order_by": 'expiration_day'
     }
@@ -113,6 +322,11 @@ class UserDebt(db.Model, AbstractModel):
 
 class UserPayment(db.Model, AbstractModel):
     __tablename__ = 'users_payments'
+    __table_args__ = (
+        db.Index('ix_users_payments_user_id_year_month_id', 'user_id', 'year', 'month', 'id'),
+        db.UniqueConstraint('user_debt_id', 'year', 'month', name='uq_users_payments_user_debt_id_year_month'),
+        db.Index('ix_users_payments_unpaid_year_month_id', 'year', 'month', 'id', postgresql_where=text('NOT is_payed')),
+    )
     __mapper_args__ = {
         "order_by": '-year,-month'
     }
@@ -128,6 +342,124 @@ class UserPayment(db.Model, AbstractModel):
     is_payed = db.Column(db.Boolean(), nullable=False, default=False, server_default="false")
     payment_info = db.Column(db.String())
 
+    patchable_columns = (('is_payed', 'boolean'), ('payment_info', 'varchar'), ('value', 'numeric(7, 2)'))
+
+    @classmethod
+    def list_expiring(cls, month_days, after_id, limit):
+        """
+        Lists the unpaid payments whose debt expires in the given days, ordered by id and after `after_id`.
+        `month_days` is a list of (year, month, first_day, last_day) ranges.
+        :return A list of dicts with the payment, debt and user data
+        :rtype: list
+        """
+        payments = cls.__table__
+        debts = UserDebt.__table__
+        users = User.__table__
+        in_window = or_(*[
+            and_(
+                payments.c.year == year,
+                payments.c.month == month,
+                debts.c.expiration_day.between(first_day, last_day)
+            )
+            for year, month, first_day, last_day in month_days
+        ])
+        query = select([
+            payments.c.id.label('payment_id'),
+            payments.c.year,
+            payments.c.month,
+            payments.c.value,
+            debts.c.description,
+            debts.c.expiration_day,
+            users.c.id.label('user_id'),
+            users.c.email,
+            users.c.name
+        ]).select_from(
+            payments.join(debts, payments.c.user_debt_id == debts.c.id).join(users, payments.c.user_id == users.c.id)
+        ).where(and_(
+            ~payments.c.is_payed,
+            payments.c.id > after_id,
+            in_window
+        )).order_by(payments.c.id).limit(limit)
+        return [dict(row) for row in db.session.execute(query)]
+
+    @classmethod
+    def owned_ids(cls, user_id, payment_ids):
+        return set(row[0] for row in db.session.query(cls.id).filter(cls.user_id == user_id, cls.id.in_(payment_ids)))
+
+    @classmethod
+    def list_with_debts(cls, payment_ids):
+        return cls.query.options(joinedload(cls.user_debt)).filter(cls.id.in_(payment_ids)).order_by(cls.id).all()
+
+    @classmethod
+    def update_many(cls, user_id, patches):
+        """
+        Applies the patches, dicts with the payment id and any of the patchable columns, to the user payments
+        with one UPDATE ... FROM (VALUES ...) in the same transaction. Rows the patch would not change are left alone.
+        :return The ids of the payments changed
+        :rtype: list
+        """
+        if not patches:
+            return []
+        if db.engine.dialect.name != 'postgresql':
+            return cls.__update_one_by_one(user_id, patches)
+        params = {'user_id': user_id}
+        rows = []
+        for index, patch in enumerate(patches):
+            params['id_{}'.format(index)] = patch['id']
+            values = ['CAST(:id_{} AS integer)'.format(index)]
+            for column, sql_type in cls.patchable_columns:
+                params['set_{}_{}'.format(column, index)] = column in patch
+                params['{}_{}'.format(column, index)] = patch.get(column)
+                values.append('CAST(:set_{0}_{1} AS boolean), CAST(:{0}_{1} AS {2})'.format(column, index, sql_type))
+            rows.append('({})'.format(', '.join(values)))
+        columns = ['id'] + ['set_{0}, {0}'.format(column) for column, _ in cls.patchable_columns]
+        statement = text("""
+            UPDATE users_payments AS payment
+            SET {assignments}
+            FROM (VALUES {rows}) AS patch({columns})
+            WHERE payment.id = patch.id AND payment.user_id = :user_id AND ({changes})
+            RETURNING payment.id
+        """.format(
+            assignments=', '.join(
+                '{0} = CASE WHEN patch.set_{0} THEN patch.{0} ELSE payment.{0} END'.format(column)
+                for column, _ in cls.patchable_columns
+            ),
+            rows=', '.join(rows),
+            columns=', '.join(columns),
+            changes=' OR '.join(
+                '(patch.set_{0} AND patch.{0} IS DISTINCT FROM payment.{0})'.format(column)
+                for column, _ in cls.patchable_columns
+            )
+        ))
+        try:
+            changed_ids = [row[0] for row in db.session.execute(statement, params)]
+            if changed_ids:
+                User.bump_data_version(user_id)
+            database.commit()
+            return changed_ids
+        except exc.IntegrityError as ex:
+            db.session.rollback()
+            raise cls.RepositoryError(ex.message)
+
+    @classmethod
+    def __update_one_by_one(cls, user_id, patches):
+        payments = cls.__table__
+        changed_ids = []
+        for patch in patches:
+            values = {column: patch[column] for column, _ in cls.patchable_columns if column in patch}
+            if not values:
+                continue
+            changes = or_(*(payments.c[column].is_distinct_from(value) for column, value in values.items()))
+            result = db.session.execute(
+                payments.update().where(and_(payments.c.id == patch['id'], payments.c.user_id == user_id, changes)).values(**values)
+            )
+            if result.rowcount:
+                changed_ids.append(patch['id'])
+        if changed_ids:
+            User.bump_data_version(user_id)
+        database.commit()
+        return changed_ids
+
 
 class UserAlreadyExist(Exception):
     pass
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from importlib import import_module
+
+logger = logging.getLogger(__name__)
+
+
+class Notifier(object):
+    """
+    Base class for the notifiers of expiring payments. `notify` receives a batch of payment dicts.
+    """
+    def notify(self, payments):
+        raise NotImplementedError
+
+
+class LogNotifier(Notifier):
+    """
+    Local stand in which just logs each expiring payment
+    """
+    def notify(self, payments):
+        for payment in payments:
+            logger.info(
+                'Payment %(payment_id)s of %(email)s for %(description)s expires on %(year)s-%(month)02d-%(expiration_day)02d',
+                payment
+            )
+
+
+class MemoryNotifier(Notifier):
+    """
+    Keeps every batch notified, for tests
+    """
+    batches = []
+
+    def notify(self, payments):
+        self.batches.append(payments)
+
+
+def create_notifier(notifier_path):
+    module_name, class_name = notifier_path.rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from datetime import datetime
+from threading import Event, Thread
+from timeit import default_timer
+import json
+import os
+import random
+import re
+import sys
+import threading
+
+from flask import g, request
+
+UNSAFE_PATH_CHARACTERS = re.compile(r'[^A-Za-z0-9]+')
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return '{}:{}:{}'.format(os.path.relpath(code.co_filename), code.co_firstlineno, code.co_name)
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler(object):
+    """
+    Samples the stack of one thread every `interval` seconds from a background thread
+    """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.__stopped = Event()
+        self.__thread = Thread(target=self.__sample)
+        self.__thread.daemon = True
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+
+    def __sample(self):
+        while not self.__stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            self.stacks[collapse(frame)] += 1
+
+    def top_frames(self, limit=20):
+        own = Counter()
+        total = Counter()
+        for stack, samples in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += samples
+            for name in set(frames):
+                total[name] += samples
+        return [
+            {'frame': name, 'own_samples': samples, 'total_samples': total[name]}
+            for name, samples in own.most_common(limit)
+        ]
+
+
+class RequestProfiler(object):
+    """
+    Profiles the requests with the PROFILER_TOKEN in the X-Profile header, or a PROFILER_SAMPLE_RATE share of them,
+    and writes a collapsed stack file (for flamegraph.pl or speedscope) and a JSON summary to PROFILER_DIR.
+    It is only registered in the app when PROFILER_ENABLED, so it costs nothing when off.
+    """
+    def __init__(self, app):
+        self.token = app.config.get('PROFILER_TOKEN')
+        self.sample_rate = app.config.get('PROFILER_SAMPLE_RATE', 0.0)
+        self.interval = app.config.get('PROFILER_INTERVAL', 0.005)
+        self.directory = app.config['PROFILER_DIR']
+        app.before_request(self.start)
+        app.teardown_request(self.stop)
+
+    def should_profile(self):
+        if self.token and request.headers.get('X-Profile') == self.token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        if not self.should_profile():
+            return
+        g.profiler = Sampler(threading.current_thread().ident, self.interval)
+        g.profiler_started_at = default_timer()
+        g.profiler.start()
+
+    def stop(self, exception):
+        sampler = g.get('profiler')
+        if sampler is None:
+            return
+        sampler.stop()
+        g.profiler = None
+        self.write(sampler, default_timer() - g.profiler_started_at, exception)
+
+    def write(self, sampler, duration, exception):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        name = '{}-{}-{}'.format(
+            datetime.utcnow().strftime('%Y%m%d%H%M%S%f'),
+            request.method.lower(),
+            UNSAFE_PATH_CHARACTERS.sub('_', request.path).strip('_')
+        )
+        with open(os.path.join(self.directory, '{}.collapsed'.format(name)), 'w') as collapsed:
+            for stack, samples in sorted(sampler.stacks.items()):
+                collapsed.write('{} {}\n'.format(stack, samples))
+        with open(os.path.join(self.directory, '{}.json'.format(name)), 'w') as summary:
+            json.dump({
+                'method': request.method,
+                'path': request.full_path,
+                'duration_ms': duration * 1000,
+                'interval_ms': self.interval * 1000,
+                'samples': sum(sampler.stacks.values()),
+                'error': None if exception is None else repr(exception),
+                'top_frames': sampler.top_frames()
+            }, summary, indent=2)
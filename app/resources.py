@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 
+from datetime import date
 from functools import wraps
+import base64
+import csv
+import json
 import re
 
-from flask import request, g, Response
+from flask import request, g, Response, stream_with_context, current_app
 from flask_restful import Resource
 
-from app import domain, apm
+from app import domain, apm, hashing, worker
 
 
 def login_required(f):
@@ -26,41 +30,137 @@ def not_allowed(f):
     return decorated_function
 
 
+def conditional(f):
+    """
+    Answers 304 when the If-None-Match header has the resource etag, without running the method,
+    and adds the etag to the successful responses
+    """
+    @wraps(f)
+    def decorated_function(self, *args, **kwargs):
+        etag = self.etag()
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': '"{}"'.format(etag)})
+        result = f(self, *args, **kwargs)
+        if isinstance(result, (tuple, Response)):
+            return result
+        return result, 200, {'ETag': '"{}"'.format(etag)}
+    return decorated_function
+
+
+FIRST_CAPITAL = re.compile('(.)([A-Z][a-z]+)')
+ALL_CAPITALS = re.compile('([a-z0-9])([A-Z])')
+
+
+def camel_to_snake(name):
+    return ALL_CAPITALS.sub(r'\1_\2', FIRST_CAPITAL.sub(r'\1_\2', name)).lower()
+
+
+def snake_to_camel(name):
+    result = []
+    for index, part in enumerate(name.split('_')):
+        if index == 0:
+            result.append(part.lower())
+        else:
+            result.append(part.capitalize())
+    return ''.join(result)
+
+
+class KeyTranslator(object):
+    """
+    Memoizes a key translation function. Keys come from the clients too, so only the first `max_size` are kept.
+    """
+    max_size = 2048
+
+    def __init__(self, translate):
+        self.translate = translate
+        self.translations = {}
+
+    def __call__(self, key):
+        try:
+            return self.translations[key]
+        except KeyError:
+            translated = self.translate(key)
+            if len(self.translations) < self.max_size:
+                self.translations[key] = translated
+            return translated
+
+
+def transform_keys(data, method):
+    if isinstance(data, dict):
+        return {method(key): transform_keys(value, method) for key, value in data.items()}
+    if isinstance(data, list):
+        for index, item in enumerate(data):
+            if isinstance(item, dict):
+                data[index] = transform_keys(item, method)
+    return data
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii'))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size or not all(isinstance(value, int) for value in values):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def parse_month(value):
+    """
+    Parses a YYYY-MM month
+    :return A tuple with the year and the month
+    :rtype: tuple
+    """
+    try:
+        year, month = [int(part) for part in value.split('-')]
+    except ValueError:
+        raise ValueError('Invalid month {}, use YYYY-MM'.format(value))
+    if not 1 <= month <= 12:
+        raise ValueError('Invalid month {}, use YYYY-MM'.format(value))
+    return year, month
+
+
+class Echo(object):
+    """
+    File like object which just returns what is written, so csv.writer can format one line at a time
+    """
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
 class ResourceBase(Resource):
     http_methods_allowed = []
     entity = None
+    max_page_size = 100
+    camel_to_snake = staticmethod(KeyTranslator(camel_to_snake))
+    snake_to_camel = staticmethod(KeyTranslator(snake_to_camel))
 
     def __init__(self):
+        self.__payload = None
         self.me = getattr(g, 'user_entity', None)
         if self.me is None and self.logged_user is not None:
             self.me = domain.User.create_with_logged(self.logged_user)
 
-    @staticmethod
-    def camel_to_snake(name):
-        s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-        return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
-
-    @staticmethod
-    def snake_to_camel(name):
-        result = []
-        for index, part in enumerate(name.split('_')):
-            if index == 0:
-                result.append(part.lower())
-            else:
-                result.append(part.capitalize())
-        return ''.join(result)
-
     def transform_key(self, data, method):
-        if isinstance(data, dict):
-            return {method(key): self.transform_key(value, method) for key, value in data.items()}
-        if isinstance(data, list):
-            for index, item in enumerate(data):
-                if isinstance(item, dict):
-                    data[index] = {method(key): self.transform_key(value, method) for key, value in item.items()}
-        return data
+        return transform_keys(data, method)
 
     @property
     def payload(self):
+        if self.__payload is None:
+            self.__payload = self.parse_payload()
+        return self.__payload
+
+    def parse_payload(self):
         payload = {}
         if request.json:
             payload = self.transform_key(request.json, self.camel_to_snake)
@@ -78,6 +178,9 @@ class ResourceBase(Resource):
     def logged_user(self):
         return getattr(g, 'user', None)
 
+    def etag(self):
+        return '{}-{}'.format(self.me.id, self.me.data_version)
+
     def return_not_found(self, entity):
         return self.response({'result': 'Resource not found', 'entity': entity}), 404
 
@@ -93,6 +196,31 @@ class ResourceBase(Resource):
     def response(self, data_dict):
         return self.transform_key(data_dict, self.snake_to_camel)
 
+    @property
+    def is_paginated(self):
+        return 'limit' in request.args or 'cursor' in request.args
+
+    def page_response(self, list_after, key_attributes):
+        """
+        Responds one keyset page of the list. `list_after(limit, after)` must return the items ordered by `key_attributes`
+        which come after the `after` values, and the next cursor is made of the last item `key_attributes` values.
+        """
+        try:
+            limit = int(request.args.get('limit', self.max_page_size))
+            if limit < 1:
+                raise ValueError('Limit must be greater than zero')
+            limit = min(limit, self.max_page_size)
+            cursor = request.args.get('cursor')
+            after = decode_cursor(cursor, len(key_attributes)) if cursor else None
+        except ValueError as ex:
+            return self.return_bad_request(ex)
+        items = list_after(limit + 1, after)
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor([getattr(items[-1], attribute) for attribute in key_attributes])
+        return self.response({'items': [item.as_dict() for item in items], 'next_cursor': next_cursor})
+
     @login_required
     def get(self, **kwargs):
         if 'GET' not in self.http_methods_allowed:
@@ -121,11 +249,13 @@ class LoginResource(ResourceBase):
     def post(self):
         try:
             user = self.entity.create_for_login(self.payload)
-            if user.is_correct:
+            if user.is_correct():
                 g.user = user.as_dict()
                 g.user_entity = user
                 g.current_token = user.generate_auth_token()
                 return {'logged': True}, 200
+        except hashing.HashingBusy:
+            return {'result': 'Too many logins, try again'}, 503, {'Retry-After': '1'}
         except Exception as ex:
             apm.monitor.capture_exception(exc_info=True)
             return {'result': 'Not Authorized'}, 401
@@ -137,11 +267,13 @@ class MeResource(ResourceBase):
     entity = domain.User
 
     @login_required
+    @conditional
     def get(self):
         try:
             if self.me is None:
                 return self.return_not_found('Me')
-            return self.response(self.me.as_dict())
+            # the etag comes from the users row, so the body has to come from it too
+            return self.response(self.me.reload_identity())
         except Exception as ex:
             apm.monitor.capture_exception(exc_info=True)
             return self.return_unexpected_error(ex)
@@ -159,8 +291,13 @@ class MeResource(ResourceBase):
 
     def post(self):
         try:
-            g.user = self.entity.create_new(self.payload)
-            return self.response({'token': g.user.generate_auth_token(), 'user': self.me.as_dict()})
+            user = self.entity.create_new(self.payload)
+            g.user = user.as_dict()
+            g.user_entity = user
+            g.current_token = user.generate_auth_token()
+            return self.response({'token': g.current_token, 'user': g.user})
+        except hashing.HashingBusy:
+            return self.response({'result': 'Too many sign ups, try again'}), 503, {'Retry-After': '1'}
         except KeyError as ex:
             apm.monitor.capture_exception(exc_info=True)
             return self.return_bad_request(ex)
@@ -174,10 +311,13 @@ class MeResource(ResourceBase):
 
 class UserDebtsResource(ResourceBase):
     @login_required
+    @conditional
     def get(self, debt_id=None):
         super(UserDebtsResource, self).get()
         if debt_id is None:
-            return [self.response(debt.as_dict()) for debt in self.me.debts]
+            if self.is_paginated:
+                return self.page_response(self.me.list_debts_after, ('expiration_day', 'id'))
+            return self.response(self.me.debts_as_dict())
         try:
             debt = self.me.get_debt(debt_id)
             return self.response(debt.as_dict())
@@ -214,12 +354,127 @@ class UserDebtsResource(ResourceBase):
             return self.return_unexpected_error(ex)
 
 
+class UserDebtsBulkResource(ResourceBase):
+    """
+    Imports debts from a CSV, read as a stream, or from a JSON array, which is parsed whole,
+    so it is limited to BULK_JSON_MAX_BYTES and BULK_JSON_MAX_ROWS
+    """
+    def csv_rows(self):
+        for row in csv.DictReader(request.stream):
+            yield {self.camel_to_snake(key.strip()): value for key, value in row.items() if key}
+
+    @property
+    def json_too_large(self):
+        return request.content_length is None or request.content_length > current_app.config['BULK_JSON_MAX_BYTES']
+
+    def json_rows(self):
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            raise ValueError('Send a JSON array or a CSV of debts')
+        if len(rows) > current_app.config['BULK_JSON_MAX_ROWS']:
+            raise ValueError('Send at most {} debts as JSON, or send them as CSV'.format(current_app.config['BULK_JSON_MAX_ROWS']))
+        for row in rows:
+            yield self.transform_key(row, self.camel_to_snake) if isinstance(row, dict) else {}
+
+    @login_required
+    def post(self):
+        super(UserDebtsBulkResource, self).post()
+        try:
+            if request.mimetype == 'text/csv':
+                rows = self.csv_rows()
+            elif self.json_too_large:
+                return self.response({
+                    'result': 'Request entity too large',
+                    'max_bytes': current_app.config['BULK_JSON_MAX_BYTES']
+                }), 413
+            else:
+                rows = self.json_rows()
+            created = self.me.import_debts(rows)
+            return self.response({'created': created}), 201
+        except (ValueError, csv.Error) as ex:
+            return self.return_bad_request(ex)
+        except domain.InvalidRows as ex:
+            return self.response({'result': 'Bad request', 'errors': ex.errors}), 400
+        except Exception as ex:
+            apm.monitor.capture_exception(exc_info=True)
+            return self.return_unexpected_error(ex)
+
+
+class ExportResourceBase(ResourceBase):
+    """
+    Streams all user items as CSV or NDJSON, one line at a time while they are read from the database
+    """
+    name = None
+    csv_columns = ()
+
+    def items(self):
+        raise NotImplementedError
+
+    def csv_row(self, item_dict):
+        return [csv_value(item_dict[column]) for column in self.csv_columns]
+
+    def csv_lines(self):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.csv_columns)
+        for item in self.items():
+            yield writer.writerow(self.csv_row(item.as_dict()))
+
+    def ndjson_lines(self):
+        for item in self.items():
+            yield json.dumps(self.response(item.as_dict())) + '\n'
+
+    @login_required
+    def get(self):
+        super(ExportResourceBase, self).get()
+        export_format = request.args.get('format', 'csv')
+        if export_format == 'csv':
+            lines, mimetype = self.csv_lines(), 'text/csv'
+        elif export_format == 'ndjson':
+            lines, mimetype = self.ndjson_lines(), 'application/x-ndjson'
+        else:
+            return self.return_bad_request(ValueError('Export format must be csv or ndjson'))
+        return Response(
+            stream_with_context(lines),
+            mimetype=mimetype,
+            headers={'Content-Disposition': 'attachment; filename={}.{}'.format(self.name, export_format)}
+        )
+
+
+class UserDebtsExportResource(ExportResourceBase):
+    name = 'debts'
+    csv_columns = ('id', 'description', 'expiration_day', 'value', 'quantity', 'is_recurrent')
+
+    def items(self):
+        return self.me.stream_debts()
+
+
+class UserPaymentsExportResource(ExportResourceBase):
+    name = 'payments'
+    csv_columns = ('id', 'date', 'value', 'status', 'is_payed', 'payment_info', 'debt_id', 'debt_description')
+
+    def csv_row(self, item_dict):
+        item_dict['debt_id'] = item_dict['debt']['id']
+        item_dict['debt_description'] = item_dict['debt']['description']
+        return super(UserPaymentsExportResource, self).csv_row(item_dict)
+
+    def items(self):
+        return self.me.stream_payments()
+
+
 class UserPaymentsResource(ResourceBase):
+    def etag(self):
+        return '{}-{}'.format(super(UserPaymentsResource, self).etag(), date.today().isoformat())
+
     @login_required
+    @conditional
     def get(self, payment_id=None):
         super(UserPaymentsResource, self).get()
         if payment_id is None:
-            return [self.response(payment.as_dict()) for payment in self.me.current_payments]
+            if 'from' in request.args or 'to' in request.args:
+                return self.history_response()
+            if self.is_paginated:
+                return self.page_response(self.me.list_payments_after, ('year', 'month', 'id'))
+            return self.response(self.me.current_payments_as_dict())
         try:
             payment = self.me.get_payment(payment_id)
             return self.response(payment.as_dict())
@@ -227,6 +482,20 @@ class UserPaymentsResource(ResourceBase):
             apm.monitor.capture_exception(exc_info=True)
             return self.return_not_found('UserPayment')
 
+    def history_response(self):
+        try:
+            first_month = parse_month(request.args.get('from', request.args.get('to')))
+            last_month = parse_month(request.args.get('to', request.args.get('from')))
+        except ValueError as ex:
+            return self.return_bad_request(ex)
+        return self.response([
+            {
+                'month': '{}-{}'.format(year, str(month).zfill(2)),
+                'payments': [payment.as_dict() for payment in payments]
+            }
+            for (year, month), payments in self.me.list_payments_by_month(first_month, last_month)
+        ])
+
     @login_required
     def put(self, payment_id):
         super(UserPaymentsResource, self).put()
@@ -246,13 +515,67 @@ class UserPaymentsResource(ResourceBase):
     def post(self):
         super(UserPaymentsResource, self).post()
         try:
+            if self.payload.pop('async', False) and not self.payload.get('single'):
+                year, month, months = self.me.month_payments_job(self.payload)
+                job_id = worker.submit_month_payments(self.me.id, year, month, months)
+                return self.response({'job_id': job_id, 'status_url': '/api/me/jobs/{}'.format(job_id)}), 202
             payment = self.me.create_payment(self.payload)
             if payment is not None:
                 return self.response(payment.as_dict())
             return self.response({'status': 'OK', 'message': 'payment list created'})
-        except KeyError as ex:
+        except (KeyError, ValueError) as ex:
+            apm.monitor.capture_exception(exc_info=True)
+            return self.return_bad_request(ex)
+        except Exception as ex:
+            apm.monitor.capture_exception(exc_info=True)
+            return self.return_unexpected_error(ex)
+
+
+class UserPaymentsBatchResource(ResourceBase):
+    @login_required
+    def put(self):
+        super(UserPaymentsBatchResource, self).put()
+        patches = request.get_json(silent=True)
+        if not isinstance(patches, list):
+            return self.return_bad_request(ValueError('Send a JSON array of payment patches'))
+        try:
+            payments = self.me.update_payments(self.transform_key(patches, self.camel_to_snake))
+            return self.response([payment.as_dict() for payment in payments])
+        except domain.NotExist:
             apm.monitor.capture_exception(exc_info=True)
+            return self.return_not_found('UserPayment')
+        except ValueError as ex:
             return self.return_bad_request(ex)
+        except domain.InvalidRows as ex:
+            return self.response({'result': 'Bad request', 'errors': ex.errors}), 400
         except Exception as ex:
             apm.monitor.capture_exception(exc_info=True)
             return self.return_unexpected_error(ex)
+
+
+class UserPaymentsSummaryResource(ResourceBase):
+    def etag(self):
+        return '{}-{}'.format(super(UserPaymentsSummaryResource, self).etag(), date.today().isoformat())
+
+    @login_required
+    @conditional
+    def get(self):
+        super(UserPaymentsSummaryResource, self).get()
+        today = date.today()
+        try:
+            year = int(request.args.get('year', today.year))
+            month = int(request.args.get('month', today.month))
+            if not 1 <= month <= 12:
+                raise ValueError('month must be between 1 and 12')
+        except ValueError as ex:
+            return self.return_bad_request(ex)
+        return self.response(self.me.payments_summary(year, month))
+
+
+class UserJobsResource(ResourceBase):
+    @login_required
+    def get(self, job_id):
+        super(UserJobsResource, self).get()
+        if not worker.is_job_owner(job_id, self.me.id):
+            return self.return_not_found('Job')
+        return self.response(worker.job_status(job_id))
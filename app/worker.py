@@ -1,43 +1,248 @@
 # -*- coding: utf-8 -*-
 
-# import os
-# from datetime import timedelta
-
-# from celery import Celery
-# from celery.schedules import crontab
-
-# from app import models
-
-
-# wat_worker = Celery('watshodapay')
-# wat_worker.conf.update(
-#     CELERY_TASK_SERIALIZER='json',
-#     CELERY_ACCEPT_CONTENT=['json'],
-#     CELERY_RESULT_SERIALIZER='json',
-#     CELERY_TIMEZONE='America/Sao_Paulo',
-#     BROKER_URL=os.environ['REDIS_URL'],
-#     CELERY_RESULT_BACKEND=os.environ['REDIS_URL'],
-    # CELERYBEAT_SCHEDULE={
-    #     'check_expiring_debt': {
-    #         'task': 'wat_worker.check_expiring_debt',
-    #         'schedule': timedelta(hours=5)
-    #     },
-    #     'reset_payed_status': {
-    #         'task': 'wat_worker.reset_payed_status',
-    #         'schedule': crontab(minute=1, hour=0, day_of_month='1')
-    #     }
-    # }
-# )
-
-
-# @wat_worker.task(name='wat_worker.check_expiring_debt')
-# def check_expiring_debt():
-#     print 'STARTING'
-#     print 'FINISHED'
-
-
-# @wat_worker.task(name='wat_worker.reset_payed_status')
-# def reset_payed_status():
-#     print 'STARTING'
-#     models.UserDebt.clear_all_payed_status()
-#     print 'FINISHED'
+from datetime import date, timedelta
+from timeit import default_timer
+import time
+import uuid
+
+from celery import Celery, chord
+from celery.result import AsyncResult, EagerResult
+from celery.schedules import crontab
+from celery.utils.log import get_task_logger
+
+from app import config as config_module, cache, database, domain, models, notifiers
+
+# the web app, its config and the eager results are bound by init_app when the app is created
+web_app = None
+config = None
+eager_results = None
+
+logger = get_task_logger(__name__)
+
+settings = config_module.get_config()
+
+# a worker process imports the web app with its tasks, which creates it and so binds it here
+wat_worker = Celery('watshodapay', include=['app.http_app'])
+wat_worker.conf.update(
+    CELERY_TASK_SERIALIZER='json',
+    CELERY_ACCEPT_CONTENT=['json'],
+    CELERY_RESULT_SERIALIZER='json',
+    CELERY_TIMEZONE='America/Sao_Paulo',
+    CELERY_ALWAYS_EAGER=settings.CELERY_ALWAYS_EAGER,
+    BROKER_URL=settings.REDIS_URL or 'memory://',
+    CELERY_RESULT_BACKEND=settings.REDIS_URL or 'cache+memory://',
+    CELERYBEAT_SCHEDULE={
+        'check_expiring_debt': {
+            'task': 'wat_worker.check_expiring_debt',
+            'schedule': timedelta(hours=5)
+        },
+        'monthly_rollover': {
+            'task': 'wat_worker.monthly_rollover',
+            'schedule': crontab(minute=1, hour=0, day_of_month='1')
+        }
+    }
+)
+
+
+def init_app(app):
+    """
+    Binds the tasks to `app`, which they run in, and builds the cache of the eager results from its config
+    """
+    global web_app, config, eager_results
+    web_app = app
+    config = app.config
+    eager_results = cache.LRUCache('eager_results', app.config['EAGER_RESULTS_SIZE'], app.config['EAGER_RESULTS_TTL'])
+
+
+class RolloverCheckpoint(object):
+    """
+    Keeps the last user id processed by each chunk of a month rollover, so a crashed run resumes where it stopped
+    """
+    def __init__(self, year, month):
+        self.key = 'wat_worker:rollover:{}-{}'.format(year, str(month).zfill(2))
+
+    def last_user_id(self, first_id):
+        raise NotImplementedError
+
+    def save(self, first_id, user_id):
+        raise NotImplementedError
+
+
+class RedisRolloverCheckpoint(RolloverCheckpoint):
+    expiration = 60 * 60 * 24 * 40
+
+    def __init__(self, year, month):
+        import redis
+        super(RedisRolloverCheckpoint, self).__init__(year, month)
+        self.redis = redis.StrictRedis.from_url(config['REDIS_URL'])
+
+    def last_user_id(self, first_id):
+        last_user_id = self.redis.hget(self.key, first_id)
+        if last_user_id is None:
+            return None
+        return int(last_user_id)
+
+    def save(self, first_id, user_id):
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self.key, first_id, user_id)
+        pipeline.expire(self.key, self.expiration)
+        pipeline.execute()
+
+
+class MemoryRolloverCheckpoint(RolloverCheckpoint):
+    checkpoints = {}
+
+    def last_user_id(self, first_id):
+        return self.checkpoints.get(self.key, {}).get(first_id)
+
+    def save(self, first_id, user_id):
+        self.checkpoints.setdefault(self.key, {})[first_id] = user_id
+
+
+def create_checkpoint(year, month):
+    if config['REDIS_URL']:
+        return RedisRolloverCheckpoint(year, month)
+    return MemoryRolloverCheckpoint(year, month)
+
+
+def rollover_chunks(first_id, last_id, chunk_size):
+    return [(start, min(start + chunk_size - 1, last_id)) for start in range(first_id, last_id + 1, chunk_size)]
+
+
+@wat_worker.task(name='wat_worker.monthly_rollover')
+def monthly_rollover(year=None, month=None):
+    today = date.today()
+    year = year or today.year
+    month = month or today.month
+    with web_app.app_context():
+        first_id, last_id = models.User.id_range()
+    if first_id is None:
+        logger.info('Rollover %s-%s: no users', year, month)
+        return None
+    checkpoint = create_checkpoint(year, month)
+    pending = []
+    for start, end in rollover_chunks(first_id, last_id, config['ROLLOVER_CHUNK_SIZE']):
+        last_user_id = checkpoint.last_user_id(start)
+        if last_user_id is None or last_user_id < end:
+            pending.append(rollover_chunk.s(year, month, start, end))
+    logger.info('Rollover %s-%s: %s chunks pending', year, month, len(pending))
+    if not pending:
+        return None
+    return chord(pending)(rollover_report.s(year, month, time.time())).id
+
+
+@wat_worker.task(name='wat_worker.rollover_chunk')
+def rollover_chunk(year, month, first_id, last_id):
+    checkpoint = create_checkpoint(year, month)
+    last_user_id = checkpoint.last_user_id(first_id)
+    resume_from = first_id if last_user_id is None else last_user_id + 1
+    users = 0
+    payments = 0
+    start = default_timer()
+    with web_app.app_context():
+        for instance in models.User.list_in_id_range(resume_from, last_id):
+            payments += domain.User.create_with_instance(instance).create_month_payments(year, month)
+            checkpoint.save(first_id, instance.id)
+            users += 1
+    checkpoint.save(first_id, last_id)
+    return {'users': users, 'payments': payments, 'seconds': default_timer() - start}
+
+
+@wat_worker.task(name='wat_worker.rollover_report')
+def rollover_report(chunk_results, year, month, started_at):
+    users = sum(result['users'] for result in chunk_results)
+    payments = sum(result['payments'] for result in chunk_results)
+    elapsed = max(time.time() - started_at, 0.001)
+    report = {
+        'year': year,
+        'month': month,
+        'users': users,
+        'payments': payments,
+        'seconds': elapsed,
+        'users_per_second': users / elapsed
+    }
+    logger.info('Rollover %(year)s-%(month)s: %(users)s users, %(payments)s payments in %(seconds).2fs (%(users_per_second).2f users/s)', report)
+    return report
+
+
+@wat_worker.task(bind=True, name='wat_worker.generate_month_payments')
+def generate_month_payments(self, user_id, year, month, months=1):
+    created = 0
+    with web_app.app_context(), database.unit_of_work():
+        user = domain.User.create_with_id(user_id)
+        for index in range(months):
+            created += user.create_month_payments(year + (month - 1 + index) // 12, (month - 1 + index) % 12 + 1)
+            self.update_state(state='PROGRESS', meta={'done': index + 1, 'total': months, 'created': created})
+    return {'done': months, 'total': months, 'created': created}
+
+
+def submit_month_payments(user_id, year, month, months=1):
+    """
+    Submits the month payments generation as a job. The job id starts with the user id, so the owner can be checked.
+    :return The job id
+    :rtype: str
+    """
+    job_id = '{}-{}'.format(user_id, uuid.uuid4().hex)
+    result = generate_month_payments.apply_async(args=(user_id, year, month, months), task_id=job_id)
+    if isinstance(result, EagerResult):
+        # eager results are not saved in the result backend, so the job status comes from here in eager mode
+        eager_results.set(job_id, result)
+    return job_id
+
+
+def is_job_owner(job_id, user_id):
+    return job_id.split('-', 1)[0] == str(user_id)
+
+
+def job_status(job_id):
+    result = eager_results.get(job_id) or AsyncResult(job_id, app=wat_worker)
+    status = {'id': job_id, 'state': result.state}
+    if result.state == 'PROGRESS':
+        status['progress'] = result.info
+    elif result.state == 'SUCCESS':
+        status['progress'] = result.result
+        status['result'] = result.result
+    elif result.state == 'FAILURE':
+        status['error'] = str(result.result)
+    return status
+
+
+def expiring_window(today, days):
+    """
+    Splits the `days` days from `today` in (year, month, first_day, last_day) ranges, one for each month they touch
+    """
+    window = []
+    for offset in range(days + 1):
+        day = today + timedelta(days=offset)
+        if window and window[-1][:2] == (day.year, day.month):
+            window[-1] = (day.year, day.month, window[-1][2], day.day)
+        else:
+            window.append((day.year, day.month, day.day, day.day))
+    return window
+
+
+@wat_worker.task(name='wat_worker.check_expiring_debt')
+def check_expiring_debt(days=None):
+    days = config['EXPIRING_DEBT_DAYS'] if days is None else days
+    notifier = notifiers.create_notifier(config['EXPIRING_DEBT_NOTIFIER'])
+    window = expiring_window(date.today(), days)
+    payments = 0
+    batches = 0
+    last_id = 0
+    start = default_timer()
+    with web_app.app_context():
+        while True:
+            batch = models.UserPayment.list_expiring(window, last_id, config['EXPIRING_DEBT_BATCH_SIZE'])
+            if not batch:
+                break
+            for payment in batch:
+                payment['value'] = None if payment['value'] is None else float(payment['value'])
+            notifier.notify(batch)
+            payments += len(batch)
+            batches += 1
+            last_id = batch[-1]['payment_id']
+            if len(batch) < config['EXPIRING_DEBT_BATCH_SIZE']:
+                break
+    report = {'payments': payments, 'batches': batches, 'seconds': default_timer() - start}
+    logger.info('Expiring debts: %(payments)s payments in %(batches)s batches in %(seconds).2fs', report)
+    return report
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from app import config as config_module
+
+config = config_module.get_config()
+
+# the app is imported once in the master and its memory is shared copy-on-write by the forked workers
+preload_app = True
+
+# threaded workers keep serving other requests while one waits on Postgres or Redis; each thread has its own
+# app context and so its own database session. GUNICORN_WORKER_CLASS=sync goes back to one request per process.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+# threads are sized first, then the pool of each worker gets one connection per thread, so no thread waits
+# for a connection another thread of the same worker holds, and all the pools fit in DATABASE_MAX_CONNECTIONS
+workers, threads = config_module.web_concurrency(
+    multiprocessing.cpu_count(),
+    config.DATABASE_MAX_CONNECTIONS,
+    config.SQLALCHEMY_EXTERNAL_POOLER,
+    workers=int(os.environ.get('WEB_CONCURRENCY', 0)) or None,
+    threads=int(os.environ.get('GUNICORN_THREADS', 0)) or (None if worker_class == 'gthread' else 1)
+)
+# the app is created from this same config object, in the master with preload_app.
+# An explicit DATABASE_POOL_SIZE or DATABASE_MAX_OVERFLOW is kept as given.
+if 'DATABASE_POOL_SIZE' not in os.environ:
+    config.SQLALCHEMY_POOL_SIZE = threads
+if 'DATABASE_MAX_OVERFLOW' not in os.environ:
+    config.SQLALCHEMY_MAX_OVERFLOW = 0
+if config.SQLALCHEMY_EXTERNAL_POOLER:
+    connections_per_worker = threads
+else:
+    connections_per_worker = config.SQLALCHEMY_POOL_SIZE + config.SQLALCHEMY_MAX_OVERFLOW
+
+# every worker writes its metrics here, so /metrics answers with the sum of all of them
+metrics_dir = os.environ.setdefault('prometheus_multiproc_dir', os.path.join(tempfile.gettempdir(), 'watshodapay-metrics'))
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    server.log.info(
+        'Serving with %s %s workers of %s threads, up to %s database connections',
+        workers, worker_class, threads, workers * connections_per_worker
+    )
+    if connections_per_worker < threads:
+        server.log.warning(
+            'The database pool of %s connections is smaller than the %s threads of a worker, so threads may wait for one',
+            connections_per_worker, threads
+        )
+    if workers * connections_per_worker > config.DATABASE_MAX_CONNECTIONS:
+        server.log.warning(
+            'Up to %s database connections is over DATABASE_MAX_CONNECTIONS (%s)',
+            workers * connections_per_worker, config.DATABASE_MAX_CONNECTIONS
+        )
+
+
+def post_fork(server, worker):
+    from app import database, hashing, http_app
+    database.dispose_connections(http_app.web_app)
+    # before the worker starts its threads, so the hashing processes fork from a single threaded process
+    hashing.pool.start()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
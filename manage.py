@@ -5,14 +5,144 @@ from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 import sys
 
-from app import initialize
+from app import database, http_app
 from app.models import *
 
-manager = Manager(initialize.web_app)
+manager = Manager(http_app.web_app)
+
+
+@manager.option('-u', '--users', dest='users', default=100, type=int)
+@manager.option('-d', '--debts', dest='debts', default=20, type=int)
+@manager.option('-m', '--months', dest='months', default=12, type=int)
+@manager.option('-s', '--create-schema', dest='create_schema', action='store_true', default=False)
+def seed(users, debts, months, create_schema):
+    """
+    Seeds users with debts and months of payments
+    """
+    from app import benchmarks
+    if create_schema:
+        db.create_all()
+    start = benchmarks.default_timer()
+    prefix = benchmarks.seed(users, debts, months)
+    print('Seeded {} users, {} debts and {} payments with prefix {} in {:.2f}s'.format(
+        users, users * debts, users * debts * months, prefix, benchmarks.default_timer() - start
+    ))
+
+
+@manager.command
+def bench_endpoints(requests=100, debts=20, months=12):
+    """
+    Measures throughput, latency percentiles and queries per request of the main endpoints
+    """
+    from app import benchmarks
+    results = benchmarks.endpoints(int(requests), int(debts), int(months))
+    benchmarks.print_results('endpoints with {} debts and {} months'.format(debts, months), results)
+
+
+@manager.command
+def bench_month_payments(debts=40, rounds=5):
+    """
+    Compares the per debt and the set based month payment generation
+    """
+    from app import benchmarks
+    results = benchmarks.month_payments(int(debts), int(rounds))
+    benchmarks.print_results('create_month_payments with {} debts'.format(debts), results)
+
+
+@manager.command
+def bench_login(concurrency=8, requests=20):
+    """
+    Measures login throughput and latency percentiles under concurrent load
+    """
+    from app import benchmarks
+    results = benchmarks.login(int(concurrency), int(requests))
+    benchmarks.print_results('/api/login with {} concurrent clients'.format(concurrency), results)
+
+
+@manager.command
+def check_concurrency(concurrency=16, requests=25):
+    """
+    Serves different users from concurrent threads of one process and checks no response leaks across them
+    """
+    from app import benchmarks
+    results = benchmarks.concurrent_requests(int(concurrency), int(requests))
+    benchmarks.print_results('{} concurrent users'.format(concurrency), results)
+    failures = results['me_and_debts']
+    if failures['errors'] or failures['wrong_user'] or failures['wrong_debts']:
+        sys.exit(1)
+
+
+@manager.command
+def check_read_replica(email):
+    """
+    Checks the reads of GET requests go to DATABASE_REPLICA_URL and everything else to DATABASE_URL
+    """
+    from app import benchmarks
+    if not database.has_replica(http_app.web_app):
+        print('DATABASE_REPLICA_URL is not set')
+        sys.exit(1)
+    results = benchmarks.replica_routing(email)
+    benchmarks.print_results('statements per database', results)
+    misrouted = [
+        name for name, counts in results.items()
+        if counts['primary' if name.startswith('get_') else 'replica']
+    ]
+    if misrouted:
+        print('Misrouted: {}'.format(', '.join(sorted(misrouted))))
+        sys.exit(1)
+
+
+@manager.command
+def bench_key_translation(items=500, rounds=20):
+    """
+    Compares the plain and the memoized camelCase key translation of a list response
+    """
+    from app import benchmarks
+    results = benchmarks.key_translation(int(items), int(rounds))
+    benchmarks.print_results('snake_to_camel on {} payments'.format(items), results)
+
+
+@manager.command
+def bench_boot(rounds=5):
+    """
+    Measures the import, app creation and first request time of a fresh worker
+    """
+    from app import benchmarks
+    benchmarks.print_results('boot in {} fresh interpreters'.format(rounds), benchmarks.boot(int(rounds)))
+
+
+@manager.command
+def explain_payments(user_id, year, month):
+    """
+    Prints the query plans of the payment lookups of a user
+    """
+    from app import benchmarks
+    for name, plan in sorted(benchmarks.explain_payment_queries(int(user_id), int(year), int(month)).items()):
+        print(name)
+        for line in plan:
+            print('  {}'.format(line))
+
+
+@manager.command
+def bench_write_endpoints(rounds=20):
+    """
+    Compares the write endpoints with the request unit of work and with a commit per save
+    """
+    from app import benchmarks
+    benchmarks.print_results('write endpoints', benchmarks.write_endpoints(int(rounds)))
+
+
+@manager.command
+def monthly_rollover(year=None, month=None):
+    """
+    Runs the monthly payment rollover for every user
+    """
+    from app import worker
+    worker.monthly_rollover.apply(args=(year and int(year), month and int(month)))
 
 
 def register_migrate(manager):
-    migrate = Migrate(initialize.web_app, db)
+    migrate = Migrate(http_app.web_app, db)
     manager.add_command('db', MigrateCommand)
     return migrate
 
@@ -0,0 +1,26 @@
+"""keyset pagination indexes
+
+Revision ID: 3f1c2a7d9e41
+Revises: 8bda0988692c
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9e41'
+down_revision = '8bda0988692c'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_users_debts_user_id_expiration_day_id', 'users_debts', ['user_id', 'expiration_day', 'id'], unique=False)
+    op.create_index('ix_users_payments_user_id_year_month_id', 'users_payments', ['user_id', 'year', 'month', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_payments_user_id_year_month_id', table_name='users_payments')
+    op.drop_index('ix_users_debts_user_id_expiration_day_id', table_name='users_debts')
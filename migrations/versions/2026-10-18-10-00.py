@@ -0,0 +1,47 @@
+"""unique payment per debt and month
+
+Revision ID: 6b8e0f4c5a27
+Revises: 3f1c2a7d9e41
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b8e0f4c5a27'
+down_revision = '3f1c2a7d9e41'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import logging
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.env')
+
+DUPLICATES = """
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY user_debt_id, year, month ORDER BY is_payed DESC, id
+        ) AS position
+        FROM users_payments
+    ) AS ranked
+    WHERE position > 1
+"""
+
+
+def upgrade():
+    # keeps one payment per debt and month, preferring the payed one. The others, with their payment_info,
+    # are kept in users_payments_duplicates to be checked by hand, and go back to users_payments on downgrade.
+    op.execute('CREATE TABLE users_payments_duplicates AS SELECT * FROM users_payments WHERE id IN ({})'.format(DUPLICATES))
+    duplicates = op.get_bind().execute('SELECT id, user_debt_id, year, month FROM users_payments_duplicates ORDER BY id').fetchall()
+    for payment_id, user_debt_id, year, month in duplicates:
+        logger.warning('Moving duplicate payment %s of debt %s for %s-%s to users_payments_duplicates', payment_id, user_debt_id, year, month)
+    logger.info('Moved %s duplicate payments to users_payments_duplicates', len(duplicates))
+    op.execute('DELETE FROM users_payments WHERE id IN (SELECT id FROM users_payments_duplicates)')
+    op.create_unique_constraint('uq_users_payments_user_debt_id_year_month', 'users_payments', ['user_debt_id', 'year', 'month'])
+
+
+def downgrade():
+    op.drop_constraint('uq_users_payments_user_debt_id_year_month', 'users_payments', type_='unique')
+    op.execute('INSERT INTO users_payments SELECT * FROM users_payments_duplicates')
+    op.drop_table('users_payments_duplicates')
@@ -0,0 +1,24 @@
+"""user data version
+
+Revision ID: c2d4e6f8a013
+Revises: 6b8e0f4c5a27
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c2d4e6f8a013'
+down_revision = '6b8e0f4c5a27'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('users', sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'data_version')
@@ -0,0 +1,27 @@
+"""unpaid payments index
+
+Revision ID: 0e5a9b3c7d62
+Revises: c2d4e6f8a013
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0e5a9b3c7d62'
+down_revision = 'c2d4e6f8a013'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index(
+        'ix_users_payments_unpaid_year_month_id', 'users_payments', ['year', 'month', 'id'],
+        unique=False, postgresql_where=sa.text('NOT is_payed')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_users_payments_unpaid_year_month_id', table_name='users_payments')
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+# the app reads its config on import, so the test settings have to be in place before any test module imports it
+os.environ['APP_SETTINGS'] = 'app.config.TestingConfig'
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(prefix='watshodapay-tests-'), 'test.db')))
+os.environ.setdefault('SECRET_KEY', 'TEST SECRET KEY')
+os.environ.setdefault('APM_SECRET_TOKEN', 'TEST')
+os.environ.setdefault('APM_SERVER_URL', 'http://localhost:8200')
+os.environ.pop('REDIS_URL', None)
+os.environ.pop('DATABASE_REPLICA_URL', None)
+# the `should` syntax of sure patches object, which breaks the SQLAlchemy mappers; the tests use `expect`
+os.environ['SURE_DISABLE_NEW_SYNTAX'] = 'true'
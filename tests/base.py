@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from decimal import Decimal
+import json
+import unittest
+
+from app import database, domain, hashing, models
+from app.http_app import web_app
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    Creates the tables before each test and drops them after. The test itself runs without an app context,
+    so every request of the test client gets its own one, and its own session, like in production.
+    """
+    def setUp(self):
+        self.app = web_app
+        self.client = web_app.test_client()
+        with web_app.app_context():
+            database.AppRepository.db.create_all()
+        domain.authenticated_users.clear()
+        domain.user_lists.client.values.clear()
+
+    def tearDown(self):
+        with web_app.app_context():
+            database.AppRepository.db.session.remove()
+            database.AppRepository.db.drop_all()
+
+    def create_user(self, email='user@watshodapay.local', password='secret', name='User', debts=()):
+        """
+        Creates a user with a debt for each dict of `debts`
+        :return The user id
+        :rtype: int
+        """
+        with web_app.app_context():
+            db = database.AppRepository.db
+            user = models.User.create_from_json({'email': email, 'password': hashing.hash_password(password), 'name': name})
+            for index, debt in enumerate(debts):
+                debt_data = {'description': 'Debt {}'.format(index), 'expiration_day': 10, 'value': Decimal('10.00')}
+                debt_data.update(debt)
+                db.session.add(models.UserDebt(user_id=user.id, **debt_data))
+            db.session.commit()
+            return user.id
+
+    def auth_headers(self, user_id):
+        with web_app.app_context():
+            return {'XSRF-TOKEN': domain.User.create_with_id(user_id).generate_auth_token()}
+
+    def get_as(self, user_id, path, **headers):
+        headers.update(self.auth_headers(user_id))
+        return self.client.get(path, headers=headers)
+
+    def send_as(self, user_id, method, path, data):
+        return self.client.open(
+            path, method=method, data=json.dumps(data), content_type='application/json', headers=self.auth_headers(user_id)
+        )
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from sure import expect
+
+from app import models
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class PaymentsBatchUpdateTest(AppTestCase):
+    def setUp(self):
+        super(PaymentsBatchUpdateTest, self).setUp()
+        self.user_id = self.create_user(debts=[{'quantity': None}, {'quantity': None}])
+        self.send_as(self.user_id, 'POST', '/api/me/payments', {'year': 2026, 'month': 10})
+        with web_app.app_context():
+            self.payment_ids = sorted(payment.id for payment in models.UserPayment.query.filter_by(user_id=self.user_id))
+
+    def put_batch(self, patches, user_id=None):
+        return self.send_as(user_id or self.user_id, 'PUT', '/api/me/payments/batch', patches)
+
+    def data_version(self):
+        with web_app.app_context():
+            return models.User.get_data_version(self.user_id)
+
+    def test_updates_the_payments_and_returns_them(self):
+        response = self.put_batch([{'id': self.payment_ids[0], 'isPayed': True, 'paymentInfo': 'Paid by card'}])
+        expect(response.status_code).to.equal(200)
+        payments = json.loads(response.data)
+        expect([payment['id'] for payment in payments]).to.equal([self.payment_ids[0]])
+        expect(payments[0]['isPayed']).to.be.true
+
+    def test_returns_only_the_payments_which_changed(self):
+        self.put_batch([{'id': self.payment_ids[0], 'isPayed': True}])
+        version = self.data_version()
+        response = self.put_batch([{'id': self.payment_ids[0], 'isPayed': True}, {'id': self.payment_ids[1], 'isPayed': True}])
+        expect([payment['id'] for payment in json.loads(response.data)]).to.equal([self.payment_ids[1]])
+        expect(self.put_batch([{'id': self.payment_ids[1], 'isPayed': True}]).data.strip()).to.equal('[]')
+        expect(self.data_version()).to.equal(version + 1)
+
+    def test_rejects_values_the_column_can_not_hold(self):
+        response = self.put_batch([{'id': self.payment_ids[0], 'value': 100000}, {'id': self.payment_ids[1], 'value': True}])
+        expect(response.status_code).to.equal(400)
+        expect(json.loads(response.data)['errors']).to.equal([
+            {'row': 1, 'errors': ['value must be less than 100000']},
+            {'row': 2, 'errors': ['value must be a number']},
+        ])
+
+    def test_rejects_invalid_and_repeated_patches(self):
+        response = self.put_batch([
+            {'id': self.payment_ids[0], 'isPayed': 'yes', 'year': 2020},
+            {'id': self.payment_ids[1]},
+            {'id': self.payment_ids[1]},
+            'payment',
+        ])
+        expect(json.loads(response.data)['errors']).to.equal([
+            {'row': 1, 'errors': ['year can not be changed', 'is_payed must be true or false']},
+            {'row': 3, 'errors': ['payment {} is repeated'.format(self.payment_ids[1])]},
+            {'row': 4, 'errors': ['patch must be an object']},
+        ])
+
+    def test_changes_nothing_when_a_payment_is_not_owned(self):
+        other_id = self.create_user(email='other@watshodapay.local')
+        response = self.put_batch([{'id': self.payment_ids[0], 'isPayed': True}], user_id=other_id)
+        expect(response.status_code).to.equal(404)
+        with web_app.app_context():
+            expect(models.UserPayment.query.get(self.payment_ids[0]).is_payed).to.be.false
+
+    def test_rejects_more_patches_than_the_maximum(self):
+        patches = [{'id': payment_id} for payment_id in range(web_app.config['BATCH_UPDATE_MAX_SIZE'] + 1)]
+        expect(self.put_batch(patches).status_code).to.equal(400)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from mock import patch
+from sure import expect
+
+from app import models
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class DebtsBulkImportTest(AppTestCase):
+    def setUp(self):
+        super(DebtsBulkImportTest, self).setUp()
+        self.user_id = self.create_user()
+
+    def post_csv(self, body):
+        return self.client.post(
+            '/api/me/debts/bulk', data=body, content_type='text/csv', headers=self.auth_headers(self.user_id)
+        )
+
+    def debts_count(self):
+        with web_app.app_context():
+            return models.UserDebt.query.filter_by(user_id=self.user_id).count()
+
+    def test_imports_a_csv(self):
+        response = self.post_csv('description,expirationDay,value,quantity\nRent,5,800.00,\nCar,10,300,12\n')
+        expect(response.status_code).to.equal(201)
+        expect(json.loads(response.data)).to.equal({'created': 2})
+        expect(self.debts_count()).to.equal(2)
+
+    def test_imports_a_json_array(self):
+        response = self.send_as(self.user_id, 'POST', '/api/me/debts/bulk', [
+            {'description': 'Rent', 'expirationDay': 5, 'value': 800},
+        ])
+        expect(response.status_code).to.equal(201)
+        expect(self.debts_count()).to.equal(1)
+
+    def test_creates_nothing_when_a_row_is_invalid(self):
+        response = self.post_csv('description,expirationDay,value\nRent,5,800.00\n,40,abc\n')
+        expect(response.status_code).to.equal(400)
+        expect(json.loads(response.data)['errors']).to.equal([{
+            'row': 2,
+            'errors': ['description is required', 'expiration_day must be between 1 and 31', 'value must be a number']
+        }])
+        expect(self.debts_count()).to.equal(0)
+
+    def test_stops_reporting_after_the_maximum_errors(self):
+        with patch.dict(web_app.config, {'BULK_MAX_ERRORS': 2}):
+            response = self.post_csv('description,expirationDay\n' + ',1\n' * 5)
+        expect(json.loads(response.data)['errors']).to.have.length_of(2)
+
+    def test_rejects_a_body_which_is_not_an_array(self):
+        response = self.send_as(self.user_id, 'POST', '/api/me/debts/bulk', {'description': 'Rent'})
+        expect(response.status_code).to.equal(400)
+
+    def test_rejects_json_with_more_rows_than_the_limit(self):
+        with patch.dict(web_app.config, {'BULK_JSON_MAX_ROWS': 2}):
+            response = self.send_as(self.user_id, 'POST', '/api/me/debts/bulk', [
+                {'description': 'Debt', 'expirationDay': 1}
+            ] * 3)
+        expect(response.status_code).to.equal(400)
+        expect(self.debts_count()).to.equal(0)
+
+    def test_does_not_parse_json_bigger_than_the_limit(self):
+        with patch.dict(web_app.config, {'BULK_JSON_MAX_BYTES': 10}), patch('flask.Request.get_json') as get_json:
+            response = self.send_as(self.user_id, 'POST', '/api/me/debts/bulk', [{'description': 'Rent', 'expirationDay': 1}])
+        expect(response.status_code).to.equal(413)
+        expect(get_json.called).to.be.false
+
+    def test_rolls_back_every_batch_when_the_insert_fails(self):
+        with patch.dict(web_app.config, {'BULK_INSERT_BATCH_SIZE': 1}), \
+                patch.object(models.User, 'bump_data_version', side_effect=models.exc.IntegrityError('', {}, Exception('unique'))):
+            response = self.post_csv('description,expirationDay\nRent,1\nCar,2\n')
+        expect(response.status_code).to.equal(500)
+        expect(self.debts_count()).to.equal(0)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from mock import Mock, patch
+from sure import expect
+import redis
+
+from app import cache, database, domain, instrumentation, models
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class LRUCacheTest(AppTestCase):
+    def setUp(self):
+        super(LRUCacheTest, self).setUp()
+        self.cache = cache.LRUCache('test_lru', max_size=2, ttl=60)
+
+    def test_counts_hits_and_misses(self):
+        expect(self.cache.get('a')).to.be.none
+        self.cache.set('a', 1)
+        expect(self.cache.get('a')).to.equal(1)
+        expect(self.cache.stats()).to.equal({'size': 1, 'hits': 1, 'misses': 1})
+
+    def test_evicts_the_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        expect(self.cache.get('b')).to.be.none
+        expect(self.cache.get('a')).to.equal(1)
+
+    def test_expires_the_entries(self):
+        self.cache.set('a', 1)
+        with patch('time.time', return_value=10 ** 10):
+            expect(self.cache.get('a')).to.be.none
+
+    def test_invalidates_an_entry(self):
+        self.cache.set('a', 1)
+        self.cache.invalidate('a')
+        expect(self.cache.get('a')).to.be.none
+
+
+class SharedCacheTest(AppTestCase):
+    def setUp(self):
+        super(SharedCacheTest, self).setUp()
+        self.cache = cache.SharedCache('test_shared', cache.FakeRedis(), ttl=60)
+
+    def test_reads_through(self):
+        load = Mock(return_value=[1, 2])
+        expect(self.cache.get_or_set('key', load)).to.equal([1, 2])
+        expect(self.cache.get_or_set('key', load)).to.equal([1, 2])
+        expect(load.call_count).to.equal(1)
+        expect(self.cache.stats()).to.equal({'hits': 1, 'misses': 1, 'errors': 0})
+
+    def test_deleted_keys_are_loaded_again(self):
+        self.cache.set('key', [1])
+        self.cache.delete('key')
+        expect(self.cache.get('key')).to.be.none
+
+    def test_takes_redis_down_as_a_miss_and_leaves_it_alone_for_a_while(self):
+        client = Mock()
+        client.get.side_effect = redis.ConnectionError('down')
+        self.cache.client = client
+        load = Mock(return_value=[1])
+        expect(self.cache.get_or_set('key', load)).to.equal([1])
+        expect(self.cache.get_or_set('key', load)).to.equal([1])
+        expect(load.call_count).to.equal(2)
+        expect(client.get.call_count).to.equal(1)
+        expect(client.setex.called).to.be.false
+        expect(self.cache.stats()['errors']).to.equal(1)
+
+    def test_tries_redis_again_after_the_backoff(self):
+        client = Mock()
+        client.get.side_effect = redis.ConnectionError('down')
+        self.cache.client = client
+        self.cache.get('key')
+        with patch('time.time', return_value=10 ** 10):
+            self.cache.get('key')
+        expect(client.get.call_count).to.equal(2)
+
+
+class UserListsCacheTest(AppTestCase):
+    def setUp(self):
+        super(UserListsCacheTest, self).setUp()
+        self.user_id = self.create_user(debts=[{'description': 'Rent', 'quantity': None}])
+
+    def test_the_second_debts_read_comes_from_the_cache(self):
+        first = self.get_as(self.user_id, '/api/me/debts')
+        with instrumentation.query_budget() as recorder:
+            second = self.get_as(self.user_id, '/api/me/debts')
+        expect(second.data).to.equal(first.data)
+        debt_queries = [shape for shape in recorder.shapes if 'FROM users_debts' in shape]
+        expect(debt_queries).to.be.empty
+
+    def test_a_new_debt_clears_the_cached_list(self):
+        self.get_as(self.user_id, '/api/me/debts')
+        self.send_as(self.user_id, 'POST', '/api/me/debts', {'description': 'Car', 'expirationDay': 5, 'value': 100})
+        expect(json.loads(self.get_as(self.user_id, '/api/me/debts').data)).to.have.length_of(2)
+
+    def test_lists_are_read_from_the_database_while_redis_is_down(self):
+        client = Mock()
+        client.get.side_effect = redis.ConnectionError('down')
+        with patch.object(domain.user_lists, 'client', client), patch.object(cache.SharedCache, 'retry_after', 0):
+            response = self.get_as(self.user_id, '/api/me/debts')
+        expect(response.status_code).to.equal(200)
+        expect(json.loads(response.data)).to.have.length_of(1)
+
+
+class InvalidationAfterCommitTest(AppTestCase):
+    def setUp(self):
+        super(InvalidationAfterCommitTest, self).setUp()
+        self.user_id = self.create_user()
+        domain.authenticated_users.set(self.user_id, {'id': self.user_id})
+
+    def cached_identity(self):
+        return domain.authenticated_users.get(self.user_id)
+
+    def invalidate_identity(self):
+        models.after_commit(domain.authenticated_users.invalidate, self.user_id)
+
+    def test_clears_the_identity_once_the_unit_of_work_commits(self):
+        with web_app.app_context():
+            with database.unit_of_work():
+                self.invalidate_identity()
+                expect(self.cached_identity()).to.equal({'id': self.user_id})
+        expect(self.cached_identity()).to.be.none
+
+    def test_keeps_the_identity_when_the_unit_of_work_rolls_back(self):
+        with web_app.app_context():
+            try:
+                with database.unit_of_work():
+                    self.invalidate_identity()
+                    raise ValueError
+            except ValueError:
+                pass
+        expect(self.cached_identity()).to.equal({'id': self.user_id})
+
+    def test_clears_the_identity_right_away_without_a_unit_of_work(self):
+        with web_app.app_context():
+            self.invalidate_identity()
+        expect(self.cached_identity()).to.be.none
+
+    def test_the_identity_is_dropped_after_the_new_name_is_committed(self):
+        domain.authenticated_users.clear()
+        self.get_as(self.user_id, '/api/me')
+        self.send_as(self.user_id, 'PUT', '/api/me', {'name': 'Renamed'})
+        expect(domain.authenticated_users.get(self.user_id)).to.be.none
+        expect(json.loads(self.get_as(self.user_id, '/api/me').data)['name']).to.equal('Renamed')
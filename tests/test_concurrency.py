@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+from sure import expect
+
+from app import benchmarks, config
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class WebConcurrencyTest(AppTestCase):
+    def test_splits_the_connections_between_two_workers_per_cpu(self):
+        expect(config.web_concurrency(4, 20)).to.equal((9, 2))
+        expect(config.web_concurrency(1, 20)).to.equal((3, 6))
+
+    def test_has_one_thread_per_worker_when_connections_are_scarce(self):
+        expect(config.web_concurrency(16, 20)).to.equal((20, 1))
+        expect(config.web_concurrency(1, 2)).to.equal((2, 1))
+
+    def test_caps_the_given_workers_and_threads(self):
+        expect(config.web_concurrency(1, 20, workers=40)).to.equal((20, 1))
+        expect(config.web_concurrency(1, 20, threads=8)).to.equal((2, 8))
+        expect(config.web_concurrency(1, 20, workers=10, threads=10)).to.equal((2, 10))
+
+    def test_leaves_the_limit_to_an_external_pooler(self):
+        expect(config.web_concurrency(4, 20, external_pooler=True)).to.equal((9, config.DEFAULT_WORKER_THREADS))
+        expect(config.web_concurrency(4, 20, external_pooler=True, workers=40, threads=8)).to.equal((40, 8))
+
+
+class ConcurrentRequestsTest(AppTestCase):
+    def test_threads_serving_different_users_never_mix_their_responses(self):
+        # the requests run in other threads, which do not see the app context of this one
+        with web_app.app_context():
+            results = benchmarks.concurrent_requests(concurrency=8, requests=5, debts=3)['me_and_debts']
+        expect(results['errors']).to.equal(0)
+        expect(results['wrong_user']).to.equal(0)
+        expect(results['wrong_debts']).to.equal(0)
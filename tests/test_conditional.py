@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from sure import expect
+
+from app import models
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class ConditionalGetTest(AppTestCase):
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.user_id = self.create_user(name='Before', debts=[{'description': 'Rent', 'quantity': None}])
+
+    def test_answers_304_when_the_etag_matches(self):
+        response = self.get_as(self.user_id, '/api/me')
+        expect(response.status_code).to.equal(200)
+        etag = response.headers['ETag']
+        response = self.get_as(self.user_id, '/api/me', **{'If-None-Match': etag})
+        expect(response.status_code).to.equal(304)
+        expect(response.headers['ETag']).to.equal(etag)
+
+    def test_a_write_changes_the_etag(self):
+        etag = self.get_as(self.user_id, '/api/me').headers['ETag']
+        expect(self.send_as(self.user_id, 'PUT', '/api/me', {'name': 'After'}).status_code).to.equal(200)
+        response = self.get_as(self.user_id, '/api/me', **{'If-None-Match': etag})
+        expect(response.status_code).to.equal(200)
+        expect(json.loads(response.data)['name']).to.equal('After')
+
+    def test_a_change_made_by_another_process_is_not_served_from_the_identity_cache(self):
+        etag = self.get_as(self.user_id, '/api/me').headers['ETag']
+        with web_app.app_context():
+            # another worker updates the user: this process identity cache is not invalidated
+            user = models.User.get(self.user_id)
+            user.name = 'After'
+            user.save_db()
+        response = self.get_as(self.user_id, '/api/me', **{'If-None-Match': etag})
+        expect(response.status_code).to.equal(200)
+        expect(response.headers['ETag']).to_not.equal(etag)
+        expect(json.loads(response.data)['name']).to.equal('After')
+
+    def test_a_new_debt_changes_the_debts_etag_and_list(self):
+        response = self.get_as(self.user_id, '/api/me/debts')
+        etag = response.headers['ETag']
+        expect(json.loads(response.data)).to.have.length_of(1)
+        response = self.send_as(self.user_id, 'POST', '/api/me/debts', {'description': 'Car', 'expirationDay': 5, 'value': 100})
+        expect(response.status_code).to.equal(200)
+        response = self.get_as(self.user_id, '/api/me/debts', **{'If-None-Match': etag})
+        expect(response.status_code).to.equal(200)
+        expect(json.loads(response.data)).to.have.length_of(2)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+import unittest
+
+from mock import patch
+from sure import expect
+
+from app import models, notifiers, worker
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class FixedDate(date):
+    @classmethod
+    def today(cls):
+        return cls(2026, 9, 29)
+
+
+class ExpiringWindowTest(unittest.TestCase):
+    def test_splits_the_window_across_the_month_end(self):
+        expect(worker.expiring_window(date(2026, 9, 29), 3)).to.equal([(2026, 9, 29, 30), (2026, 10, 1, 2)])
+
+    def test_splits_the_window_across_the_year_end(self):
+        expect(worker.expiring_window(date(2026, 12, 30), 3)).to.equal([(2026, 12, 30, 31), (2027, 1, 1, 2)])
+
+    def test_keeps_a_window_inside_the_month_in_one_range(self):
+        expect(worker.expiring_window(date(2026, 9, 10), 3)).to.equal([(2026, 9, 10, 13)])
+
+
+class CheckExpiringDebtTest(AppTestCase):
+    def setUp(self):
+        super(CheckExpiringDebtTest, self).setUp()
+        notifiers.MemoryNotifier.batches = []
+        self.user_id = self.create_user(debts=[
+            {'description': 'Day {}'.format(day), 'expiration_day': day, 'quantity': None} for day in (28, 29, 30, 1, 2, 3)
+        ])
+        for month in (9, 10):
+            self.send_as(self.user_id, 'POST', '/api/me/payments', {'year': 2026, 'month': month})
+
+    def tearDown(self):
+        notifiers.MemoryNotifier.batches = []
+        super(CheckExpiringDebtTest, self).tearDown()
+
+    def check(self, batch_size):
+        settings = {'EXPIRING_DEBT_NOTIFIER': 'app.notifiers.MemoryNotifier', 'EXPIRING_DEBT_BATCH_SIZE': batch_size}
+        with patch.dict(web_app.config, settings), patch.object(worker, 'date', FixedDate):
+            return worker.check_expiring_debt.delay(3).get()
+
+    def notified(self):
+        return [(payment['month'], payment['description']) for batch in notifiers.MemoryNotifier.batches for payment in batch]
+
+    def test_notifies_the_payments_expiring_across_the_month_end(self):
+        report = self.check(100)
+        expect(report['payments']).to.equal(4)
+        expect(sorted(self.notified())).to.equal([(9, 'Day 29'), (9, 'Day 30'), (10, 'Day 1'), (10, 'Day 2')])
+
+    def test_notifies_each_payment_once_across_the_batches(self):
+        report = self.check(3)
+        expect(report['batches']).to.equal(2)
+        expect([len(batch) for batch in notifiers.MemoryNotifier.batches]).to.equal([3, 1])
+        payment_ids = [payment['payment_id'] for batch in notifiers.MemoryNotifier.batches for payment in batch]
+        expect(payment_ids).to.equal(sorted(set(payment_ids)))
+        expect(payment_ids).to.have.length_of(4)
+
+    def test_skips_the_paid_payments(self):
+        with web_app.app_context():
+            payment = models.UserPayment.query.filter_by(user_id=self.user_id, year=2026, month=10).join(
+                models.UserDebt
+            ).filter(models.UserDebt.expiration_day == 1).one()
+            payment_id = payment.id
+        self.send_as(self.user_id, 'PUT', '/api/me/payments/batch', [{'id': payment_id, 'isPayed': True}])
+        self.check(100)
+        expect(sorted(self.notified())).to.equal([(9, 'Day 29'), (9, 'Day 30'), (10, 'Day 2')])
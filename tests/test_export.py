@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+
+from mock import patch
+from sqlalchemy import event
+from sure import expect
+
+from app import database
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class ConnectionCounter(object):
+    def __init__(self):
+        self.open = 0
+        self.max_open = 0
+
+    def checkout(self, *args):
+        self.open += 1
+        self.max_open = max(self.max_open, self.open)
+
+    def checkin(self, *args):
+        self.open -= 1
+
+
+class ExportTest(AppTestCase):
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.user_id = self.create_user(debts=[
+            {'description': 'Debt {}'.format(index), 'expiration_day': 10 - index % 2, 'quantity': None} for index in range(5)
+        ])
+
+    def export(self, path, **params):
+        response = self.get_as(self.user_id, path + '?' + '&'.join('{}={}'.format(*item) for item in params.items()))
+        return response, response.get_data()
+
+    def test_exports_the_debts_as_csv(self):
+        response, data = self.export('/api/me/debts/export')
+        expect(response.status_code).to.equal(200)
+        expect(response.mimetype).to.equal('text/csv')
+        expect(response.headers['Content-Disposition']).to.equal('attachment; filename=debts.csv')
+        rows = list(csv.reader(data.splitlines()))
+        expect(rows[0]).to.equal(['id', 'description', 'expiration_day', 'value', 'quantity', 'is_recurrent'])
+        expect([row[1] for row in rows[1:]]).to.equal(['Debt 1', 'Debt 3', 'Debt 0', 'Debt 2', 'Debt 4'])
+        expect(rows[1][3:]).to.equal(['10.0', '', 'True'])
+
+    def test_exports_the_payments_as_ndjson(self):
+        self.send_as(self.user_id, 'POST', '/api/me/payments', {'year': 2026, 'month': 10})
+        response, data = self.export('/api/me/payments/export', format='ndjson')
+        expect(response.mimetype).to.equal('application/x-ndjson')
+        expect(response.headers['Content-Disposition']).to.equal('attachment; filename=payments.ndjson')
+        payments = [json.loads(line) for line in data.splitlines()]
+        expect(payments).to.have.length_of(5)
+        expect(payments[0]).to.have.key('debt')
+        expect(payments[0]).to.have.key('isPayed')
+
+    def test_reads_in_batches_and_keeps_the_order(self):
+        with patch.dict(web_app.config, {'EXPORT_BATCH_SIZE': 2}):
+            response, data = self.export('/api/me/debts/export')
+        expect(len(data.splitlines())).to.equal(6)
+
+    def test_holds_a_single_connection_while_streaming(self):
+        counter = ConnectionCounter()
+        with web_app.app_context():
+            engine = database.AppRepository.db.engine
+        event.listen(engine, 'checkout', counter.checkout)
+        event.listen(engine, 'checkin', counter.checkin)
+        try:
+            with patch.dict(web_app.config, {'EXPORT_BATCH_SIZE': 2}):
+                self.export('/api/me/debts/export')
+        finally:
+            event.remove(engine, 'checkout', counter.checkout)
+            event.remove(engine, 'checkin', counter.checkin)
+        expect(counter.max_open).to.equal(1)
+
+    def test_refuses_an_unknown_format(self):
+        response, _ = self.export('/api/me/debts/export', format='xml')
+        expect(response.status_code).to.equal(400)
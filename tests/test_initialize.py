@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from sure import expect
+
+from app import config as config_module, domain, hashing, initialize
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class CreateAppTest(AppTestCase):
+    def tearDown(self):
+        initialize.init_services(web_app)
+        super(CreateAppTest, self).tearDown()
+
+    def test_builds_the_services_from_the_given_config(self):
+        config = config_module.load_config()
+        config.AUTH_CACHE_SIZE = 7
+        config.HASHING_QUEUE_SIZE = 3
+        config.PASSWORD_ROUNDS = 1234
+        initialize.create_app(config)
+        expect(domain.authenticated_users.max_size).to.equal(7)
+        expect(hashing.pool.workers).to.equal(config.HASHING_WORKERS)
+        expect(hashing.context.to_dict()['sha512_crypt__default_rounds']).to.equal(1234)
+
+    def test_reads_the_settings_of_its_own_app(self):
+        config = config_module.load_config()
+        config.BATCH_UPDATE_MAX_SIZE = 1
+        app = initialize.create_app(config)
+        user_id = self.create_user()
+        client = app.test_client()
+        response = client.put('/api/me/payments/batch', data='[{"id": 1}, {"id": 2}]', content_type='application/json',
+                              headers=self.auth_headers(user_id))
+        expect(response.status_code).to.equal(400)
+        expect(response.data).to.contain('Send at most 1 payments')
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from mock import patch
+from sqlalchemy.exc import OperationalError
+from sure import expect
+
+from app import database, instrumentation
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class RequestInstrumentationTest(AppTestCase):
+    def setUp(self):
+        super(RequestInstrumentationTest, self).setUp()
+        self.user_id = self.create_user(debts=[{'quantity': None}])
+
+    def test_adds_the_server_timing_header(self):
+        response = self.get_as(self.user_id, '/api/me/debts')
+        expect(response.headers['Server-Timing']).to.contain('db;dur=')
+
+    def test_works_out_no_statement_shapes_without_the_repeat_warning(self):
+        settings = {'SERVER_TIMING': True, 'QUERY_REPEAT_WARNING': None}
+        with patch.dict(web_app.config, settings), patch.object(instrumentation, 'statement_shape') as statement_shape:
+            response = self.get_as(self.user_id, '/api/me/debts')
+        expect(response.headers).to.have.key('Server-Timing')
+        expect(statement_shape.called).to.be.false
+
+    def test_records_nothing_when_both_are_off(self):
+        settings = {'SERVER_TIMING': False, 'QUERY_REPEAT_WARNING': None}
+        with patch.dict(web_app.config, settings), patch.object(instrumentation, 'statement_shape') as statement_shape:
+            response = self.get_as(self.user_id, '/api/me/debts')
+        expect(response.headers).to_not.have.key('Server-Timing')
+        expect(statement_shape.called).to.be.false
+
+
+class FailedStatementTest(AppTestCase):
+    def test_a_failed_statement_leaves_nothing_on_the_connection(self):
+        with web_app.app_context():
+            connection = database.AppRepository.db.engine.connect()
+            try:
+                with instrumentation.query_budget() as recorder:
+                    connection.execute('SELECT 1').scalar()
+                    expect(lambda: connection.execute('SELECT * FROM missing_table')).to.throw(OperationalError)
+                    connection.execute('SELECT 2').scalar()
+                expect(connection.info).to_not.have.key('query_started_at')
+                expect(recorder.count).to.equal(2)
+            finally:
+                connection.close()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from multiprocessing import TimeoutError
+import json
+
+from mock import patch, Mock
+from sure import expect
+
+from app import hashing, models
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class LoginTest(AppTestCase):
+    def setUp(self):
+        super(LoginTest, self).setUp()
+        self.user_id = self.create_user(email='login@watshodapay.local', password='secret')
+
+    def login(self, password):
+        return self.client.post(
+            '/api/login', data=json.dumps({'username': 'login@watshodapay.local', 'password': password}),
+            content_type='application/json'
+        )
+
+    def test_logs_in_with_the_right_password(self):
+        response = self.login('secret')
+        expect(response.status_code).to.equal(200)
+        expect(response.headers).to.contain('XSRF-TOKEN')
+
+    def test_refuses_a_wrong_password(self):
+        expect(self.login('wrong').status_code).to.equal(401)
+
+    def test_answers_503_when_the_hashing_queue_is_full(self):
+        with patch.object(hashing.pool, 'run', side_effect=hashing.HashingBusy('full')):
+            response = self.login('secret')
+        expect(response.status_code).to.equal(503)
+        expect(response.headers['Retry-After']).to.equal('1')
+
+    def test_answers_503_to_a_sign_up_when_the_hashing_queue_is_full(self):
+        with patch.object(hashing.pool, 'run', side_effect=hashing.HashingBusy('full')):
+            response = self.client.post(
+                '/api/me', data=json.dumps({'email': 'new@watshodapay.local', 'password': 'secret', 'name': 'New'}),
+                content_type='application/json'
+            )
+        expect(response.status_code).to.equal(503)
+
+
+class SignUpTest(AppTestCase):
+    def sign_up(self, email):
+        return self.client.post(
+            '/api/me', data=json.dumps({'email': email, 'password': 'secret', 'name': 'New'}),
+            content_type='application/json'
+        )
+
+    def test_creates_the_user_and_returns_a_token(self):
+        response = self.sign_up('new@watshodapay.local')
+        expect(response.status_code).to.equal(200)
+        body = json.loads(response.data)
+        expect(body['token']).to.be.a(basestring)
+        expect(body['user']['email']).to.equal('new@watshodapay.local')
+        with web_app.app_context():
+            user = models.User.get_with_filter(email='new@watshodapay.local')
+            expect(user).to_not.be.none
+            expect(hashing.context.verify('secret', user.password)).to.be.true
+
+    def test_refuses_an_email_already_signed_up(self):
+        self.create_user(email='new@watshodapay.local')
+        expect(self.sign_up('new@watshodapay.local').status_code).to.equal(400)
+        with web_app.app_context():
+            expect(models.User.query.count()).to.equal(1)
+
+
+class HashingPoolTest(AppTestCase):
+    def test_hashes_in_another_process(self):
+        pool = hashing.HashingPool(1, 2, 10)
+        password_hash = pool.run('hash', 'secret')
+        expect(hashing.context.verify('secret', password_hash)).to.be.true
+        expect(pool.hashes).to.equal(1)
+
+    def test_a_timeout_is_reported_as_busy(self):
+        pool = hashing.HashingPool(1, 2, 0.01)
+        process_pool = Mock()
+        process_pool.apply_async.return_value.get.side_effect = TimeoutError()
+        with patch.object(pool, 'start', return_value=process_pool):
+            expect(pool.run).when.called_with('hash', 'secret').to.throw(hashing.HashingBusy)
+
+    def test_refuses_more_hashes_than_the_queue_size(self):
+        pool = hashing.HashingPool(1, 0, 10)
+        expect(pool.run).when.called_with('hash', 'secret').to.throw(hashing.HashingBusy)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from sure import expect
+
+from app import domain, models, worker
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class MonthPaymentsTest(AppTestCase):
+    def setUp(self):
+        super(MonthPaymentsTest, self).setUp()
+        self.user_id = self.create_user(debts=[
+            {'description': 'Instalments', 'quantity': 3},
+            {'description': 'Recurrent', 'quantity': None},
+            {'description': 'Paid off', 'quantity': 0},
+        ])
+
+    def quantities(self):
+        with web_app.app_context():
+            return {debt.description: debt.quantity for debt in models.UserDebt.list_with_filter(user_id=self.user_id)}
+
+    def payments_count(self, year, month):
+        with web_app.app_context():
+            return len(models.UserPayment.list_with_filter(user_id=self.user_id, year=year, month=month))
+
+    def create_month_payments(self, year, month):
+        with web_app.app_context():
+            return domain.User.create_with_id(self.user_id).create_month_payments(year, month)
+
+    def test_creates_the_payments_of_the_active_and_recurrent_debts(self):
+        expect(self.create_month_payments(2026, 10)).to.equal(2)
+        expect(self.payments_count(2026, 10)).to.equal(2)
+        expect(self.quantities()).to.equal({'Instalments': 2, 'Recurrent': None, 'Paid off': 0})
+
+    def test_running_twice_for_the_same_month_decreases_the_quantity_once(self):
+        self.create_month_payments(2026, 10)
+        expect(self.create_month_payments(2026, 10)).to.equal(0)
+        expect(self.payments_count(2026, 10)).to.equal(2)
+        expect(self.quantities()['Instalments']).to.equal(2)
+
+    def test_each_month_decreases_the_quantity(self):
+        self.create_month_payments(2026, 10)
+        self.create_month_payments(2026, 11)
+        expect(self.quantities()['Instalments']).to.equal(1)
+
+    def test_rollover_then_client_post_decreases_the_quantity_once(self):
+        worker.monthly_rollover.apply(args=(2026, 10))
+        response = self.send_as(self.user_id, 'POST', '/api/me/payments', {'year': 2026, 'month': 10})
+        expect(response.status_code).to.equal(200)
+        expect(self.payments_count(2026, 10)).to.equal(2)
+        expect(self.quantities()['Instalments']).to.equal(2)
+
+    def test_resumed_rollover_chunk_does_not_decrease_the_quantity_again(self):
+        worker.rollover_chunk.apply(args=(2026, 10, self.user_id, self.user_id))
+        worker.MemoryRolloverCheckpoint.checkpoints.clear()
+        worker.rollover_chunk.apply(args=(2026, 10, self.user_id, self.user_id))
+        expect(self.quantities()['Instalments']).to.equal(2)
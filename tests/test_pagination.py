@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from mock import patch
+from sure import expect
+
+from app import resources
+from tests.base import AppTestCase
+
+
+class KeysetPaginationTest(AppTestCase):
+    def setUp(self):
+        super(KeysetPaginationTest, self).setUp()
+        # two expiration days with several debts each, so the pages split inside a tie
+        self.user_id = self.create_user(debts=[
+            {'description': 'Debt {}'.format(index), 'expiration_day': 20 - index % 2, 'quantity': None} for index in range(7)
+        ])
+
+    def page(self, path, **params):
+        response = self.get_as(self.user_id, path + '?' + '&'.join('{}={}'.format(*item) for item in params.items()))
+        return response, json.loads(response.data)
+
+    def walk(self, path, limit):
+        pages = []
+        params = {'limit': limit}
+        while True:
+            response, page = self.page(path, **params)
+            expect(response.status_code).to.equal(200)
+            pages.append(page['items'])
+            if page['nextCursor'] is None:
+                return pages
+            params['cursor'] = page['nextCursor']
+
+    def test_walks_the_debts_to_the_end_breaking_ties_by_id(self):
+        pages = self.walk('/api/me/debts', 3)
+        expect([len(items) for items in pages]).to.equal([3, 3, 1])
+        debts = [debt for items in pages for debt in items]
+        expect([(debt['expirationDay'], debt['id']) for debt in debts]).to.equal(
+            sorted((debt['expirationDay'], debt['id']) for debt in debts)
+        )
+        expect(set(debt['id'] for debt in debts)).to.have.length_of(7)
+
+    def test_walks_the_payments_to_the_end_breaking_ties_by_id(self):
+        for month in (9, 10):
+            self.send_as(self.user_id, 'POST', '/api/me/payments', {'year': 2026, 'month': month})
+        pages = self.walk('/api/me/payments', 4)
+        expect([len(items) for items in pages]).to.equal([4, 4, 4, 2])
+        payments = [payment for items in pages for payment in items]
+        keys = [(payment['date'][:7], payment['id']) for payment in payments]
+        expect(keys).to.equal(sorted(keys))
+        expect(set(payment['id'] for payment in payments)).to.have.length_of(14)
+
+    def test_the_last_full_page_has_no_cursor(self):
+        response, page = self.page('/api/me/debts', limit=7)
+        expect(page['items']).to.have.length_of(7)
+        expect(page['nextCursor']).to.be.none
+
+    def test_refuses_a_malformed_cursor(self):
+        for cursor in ('not-base64!', resources.encode_cursor([1]), resources.encode_cursor(['a', 'b']), 'e30='):
+            response, page = self.page('/api/me/debts', cursor=cursor)
+            expect(response.status_code).to.equal(400)
+        response, page = self.page('/api/me/debts', limit=0)
+        expect(response.status_code).to.equal(400)
+
+    def test_caps_the_limit(self):
+        with patch.object(resources.UserDebtsResource, 'max_page_size', 5):
+            response, page = self.page('/api/me/debts', limit=1000)
+        expect(page['items']).to.have.length_of(5)
+        expect(page['nextCursor']).to_not.be.none
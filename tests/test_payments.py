@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from mock import patch
+from sure import expect
+
+from app import cache, instrumentation, worker
+from tests.base import AppTestCase
+
+
+class PaymentsHistoryTest(AppTestCase):
+    def setUp(self):
+        super(PaymentsHistoryTest, self).setUp()
+        self.user_id = self.create_user(debts=[{'description': 'Debt {}'.format(index), 'quantity': None} for index in range(5)])
+
+    def test_history_is_read_without_a_query_per_payment(self):
+        for month in (1, 2, 3):
+            self.send_as(self.user_id, 'POST', '/api/me/payments', {'year': 2026, 'month': month})
+        with instrumentation.query_budget(max_queries=6, max_repeats=2):
+            response = self.get_as(self.user_id, '/api/me/payments?from=2026-01&to=2026-03')
+        expect(response.status_code).to.equal(200)
+
+
+class MonthPaymentsJobTest(AppTestCase):
+    def setUp(self):
+        super(MonthPaymentsJobTest, self).setUp()
+        self.user_id = self.create_user(debts=[{'description': 'Instalments', 'quantity': 3}])
+
+    def test_runs_the_job_eagerly_and_reports_its_result(self):
+        response = self.send_as(self.user_id, 'POST', '/api/me/payments', {'year': 2026, 'month': 11, 'months': 2, 'async': True})
+        expect(response.status_code).to.equal(202)
+        job = json.loads(response.data)
+        status = json.loads(self.get_as(self.user_id, job['statusUrl']).data)
+        expect(status['state']).to.equal('SUCCESS')
+        expect(status['result']).to.equal({'done': 2, 'total': 2, 'created': 2})
+
+    def test_a_job_is_only_visible_to_its_owner(self):
+        job_id = json.loads(self.send_as(
+            self.user_id, 'POST', '/api/me/payments', {'year': 2026, 'month': 11, 'async': True}
+        ).data)['jobId']
+        other_id = self.create_user(email='other@watshodapay.local')
+        expect(self.get_as(other_id, '/api/me/jobs/{}'.format(job_id)).status_code).to.equal(404)
+        expect(worker.is_job_owner(job_id, self.user_id)).to.be.true
+
+    def test_keeps_only_the_latest_eager_results(self):
+        def submit():
+            return json.loads(self.send_as(
+                self.user_id, 'POST', '/api/me/payments', {'year': 2026, 'month': 11, 'async': True}
+            ).data)['jobId']
+
+        with patch.object(worker, 'eager_results', cache.LRUCache('eager_results', 1, 60)):
+            first, second = submit(), submit()
+            expect(worker.eager_results.get(first)).to.be.none
+            for _ in range(2):
+                expect(json.loads(self.get_as(self.user_id, '/api/me/jobs/{}'.format(second)).data)['state']).to.equal('SUCCESS')
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+
+from sure import expect
+
+from app import config as config_module, initialize, profiler
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class RequestProfilerTest(AppTestCase):
+    def setUp(self):
+        super(RequestProfilerTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.user_id = self.create_user(debts=[{'quantity': None}])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        initialize.init_services(web_app)
+        super(RequestProfilerTest, self).tearDown()
+
+    def profiled_client(self, enabled):
+        config = config_module.load_config()
+        config.PROFILER_ENABLED = enabled
+        config.PROFILER_TOKEN = 'profile-me'
+        config.PROFILER_SAMPLE_RATE = 0.0
+        config.PROFILER_DIR = self.directory
+        return initialize.create_app(config).test_client()
+
+    def get(self, client, **headers):
+        headers.update(self.auth_headers(self.user_id))
+        response = client.get('/api/me/debts', headers=headers)
+        expect(response.status_code).to.equal(200)
+        return sorted(os.listdir(self.directory))
+
+    def test_writes_the_profile_of_a_request_with_the_token(self):
+        files = self.get(self.profiled_client(True), **{'X-Profile': 'profile-me'})
+        expect([os.path.splitext(name)[1] for name in files]).to.equal(['.collapsed', '.json'])
+        expect(files[1]).to.contain('get-api_me_debts')
+        with open(os.path.join(self.directory, files[1])) as summary_file:
+            summary = json.load(summary_file)
+        expect(summary['method']).to.equal('GET')
+        expect(summary['path']).to.equal('/api/me/debts?')
+        expect(summary['error']).to.be.none
+        expect(summary['samples']).to.equal(sum(frame['own_samples'] for frame in summary['top_frames']))
+
+    def test_skips_the_requests_without_the_token(self):
+        expect(self.get(self.profiled_client(True))).to.be.empty
+        expect(self.get(self.profiled_client(True), **{'X-Profile': 'wrong'})).to.be.empty
+
+    def test_does_nothing_when_disabled(self):
+        client = self.profiled_client(False)
+        expect(self.get(client, **{'X-Profile': 'profile-me'})).to.be.empty
+        hooks = client.application.before_request_funcs[None] + client.application.teardown_request_funcs[None]
+        expect([hook for hook in hooks if isinstance(getattr(hook, '__self__', None), profiler.RequestProfiler)]).to.be.empty
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+
+from sure import expect
+
+from app import config as config_module, database, initialize, models
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class ReadReplicaTest(AppTestCase):
+    """
+    The replica is a copy of the SQLite file of the primary, which catches up each time replicate() copies it again
+    """
+    def setUp(self):
+        super(ReadReplicaTest, self).setUp()
+        self.primary_path = web_app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+        self.replica_path = os.path.join(tempfile.mkdtemp(prefix='watshodapay-replica-'), 'replica.db')
+        config = config_module.load_config()
+        config.SQLALCHEMY_BINDS = {'replica': 'sqlite:///{}'.format(self.replica_path)}
+        self.replica_app = initialize.create_app(config)
+        self.replica_client = self.replica_app.test_client()
+        self.user_id = self.create_user(debts=[{'description': 'Rent', 'quantity': None}])
+        self.replicate()
+
+    def tearDown(self):
+        initialize.init_services(web_app)
+        shutil.rmtree(os.path.dirname(self.replica_path), ignore_errors=True)
+        super(ReadReplicaTest, self).tearDown()
+
+    def replicate(self):
+        shutil.copyfile(self.primary_path, self.replica_path)
+
+    def debt_descriptions(self):
+        response = self.replica_client.get('/api/me/debts', headers=self.auth_headers(self.user_id))
+        return [debt['description'] for debt in json.loads(response.data)]
+
+    def add_debt(self, description):
+        response = self.replica_client.post(
+            '/api/me/debts', data=json.dumps({'description': description, 'expirationDay': 5, 'value': 10}),
+            content_type='application/json', headers=self.auth_headers(self.user_id)
+        )
+        expect(response.status_code).to.equal(200)
+
+    def test_reads_of_get_requests_come_from_the_replica(self):
+        self.add_debt('Car')
+        expect(self.debt_descriptions()).to.equal(['Rent'])
+        self.replicate()
+        expect(self.debt_descriptions()).to.equal(['Car', 'Rent'])
+
+    def test_a_list_read_from_a_lagging_replica_is_not_served_after_it_catches_up(self):
+        self.debt_descriptions()
+        self.add_debt('Car')
+        expect(self.debt_descriptions()).to.equal(['Rent'])
+        self.replicate()
+        expect(self.debt_descriptions()).to.equal(['Car', 'Rent'])
+        expect(self.debt_descriptions()).to.equal(['Car', 'Rent'])
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        self.add_debt('Car')
+        with self.replica_app.app_context():
+            database.use_replica()
+            expect(models.User.get_data_version(self.user_id)).to.equal(0)
+            models.User.bump_data_version(self.user_id)
+            expect(models.User.get_data_version(self.user_id)).to.equal(2)
+            database.AppRepository.db.session.rollback()
+            database.AppRepository.db.session.remove()
+
+    def test_writes_never_go_to_the_replica(self):
+        self.add_debt('Car')
+        with self.replica_app.app_context():
+            debts = models.UserDebt.query.filter_by(user_id=self.user_id).count()
+        expect(debts).to.equal(2)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import unittest
+
+from mock import patch
+from sure import expect
+
+from app import models, worker
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class MonthlyRolloverTest(AppTestCase):
+    def setUp(self):
+        super(MonthlyRolloverTest, self).setUp()
+        worker.MemoryRolloverCheckpoint.checkpoints.clear()
+        self.user_ids = [
+            self.create_user(email='user-{}@watshodapay.local'.format(index), debts=[{'quantity': None}])
+            for index in range(5)
+        ]
+
+    def tearDown(self):
+        worker.MemoryRolloverCheckpoint.checkpoints.clear()
+        super(MonthlyRolloverTest, self).tearDown()
+
+    def payments_by_user(self, year, month):
+        with web_app.app_context():
+            payments = models.UserPayment.list_with_filter(year=year, month=month)
+            return sorted(payment.user_id for payment in payments)
+
+    def test_creates_the_payments_of_every_user_in_chunks(self):
+        with patch.dict(web_app.config, {'ROLLOVER_CHUNK_SIZE': 2}), \
+                patch.object(worker.rollover_chunk, 's', wraps=worker.rollover_chunk.s) as chunk:
+            worker.monthly_rollover.delay(2026, 10)
+        expect(chunk.call_count).to.equal(3)
+        expect(self.payments_by_user(2026, 10)).to.equal(self.user_ids)
+
+    def test_skips_the_chunks_a_crashed_run_finished(self):
+        worker.create_checkpoint(2026, 10).save(self.user_ids[0], self.user_ids[1])
+        worker.create_checkpoint(2026, 10).save(self.user_ids[2], self.user_ids[2])
+        with patch.dict(web_app.config, {'ROLLOVER_CHUNK_SIZE': 2}):
+            worker.monthly_rollover.delay(2026, 10)
+        expect(self.payments_by_user(2026, 10)).to.equal([self.user_ids[3], self.user_ids[4]])
+
+    def test_does_nothing_when_every_chunk_is_done(self):
+        worker.create_checkpoint(2026, 10).save(self.user_ids[0], self.user_ids[-1])
+        expect(worker.monthly_rollover.delay(2026, 10).get()).to.be.none
+        expect(self.payments_by_user(2026, 10)).to.be.empty
+
+    def test_reports_the_users_per_second(self):
+        with patch('time.time', return_value=1010.0):
+            report = worker.rollover_report([{'users': 15, 'payments': 30}, {'users': 5, 'payments': 5}], 2026, 10, 1000.0)
+        expect(report['users']).to.equal(20)
+        expect(report['payments']).to.equal(35)
+        expect(report['users_per_second']).to.equal(2.0)
+
+
+class WorkerImportTest(unittest.TestCase):
+    def test_the_worker_imports_in_a_fresh_interpreter(self):
+        # the celery worker imports app.worker first, before anything else of the app
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = subprocess.Popen(
+            [sys.executable, '-c', 'import app.worker'], cwd=root, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        output = process.communicate()[0]
+        expect(process.returncode).to.equal(0)
+        expect(output).to_not.contain('Traceback')
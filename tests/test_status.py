@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from mock import patch
+from sure import expect
+
+from app import config as config_module, initialize
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class StatusRoutesTest(AppTestCase):
+    def tearDown(self):
+        initialize.init_services(web_app)
+        super(StatusRoutesTest, self).tearDown()
+
+    def test_serves_the_stats_and_the_metrics(self):
+        response = self.client.get('/stats')
+        expect(response.status_code).to.equal(200)
+        expect(json.loads(response.data)).to.have.key('caches')
+        expect(self.client.get('/metrics').data).to.contain('watshodapay_request_duration_seconds')
+
+    def test_asks_for_the_token_when_there_is_one(self):
+        with patch.dict(self.app.config, {'STATUS_TOKEN': 'scraper'}):
+            expect(self.client.get('/metrics').status_code).to.equal(401)
+            expect(self.client.get('/stats', headers={'Authorization': 'Bearer other'}).status_code).to.equal(401)
+            expect(self.client.get('/metrics', headers={'Authorization': 'Bearer scraper'}).status_code).to.equal(200)
+
+    def test_does_not_serve_them_when_disabled(self):
+        config = config_module.load_config()
+        config.STATUS_ENABLED = False
+        client = initialize.create_app(config).test_client()
+        expect(client.get('/stats').status_code).to.equal(404)
+        expect(client.get('/metrics').status_code).to.equal(404)
+
+    def test_are_disabled_unless_a_config_enables_them(self):
+        expect(config_module.Config.STATUS_ENABLED).to.be.false
+        expect(config_module.ProductionConfig.STATUS_ENABLED).to.be.false
+        expect(config_module.StagingConfig.STATUS_ENABLED).to.be.false
+        expect(config_module.DevelopmentConfig.STATUS_ENABLED).to.be.true
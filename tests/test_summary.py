@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from datetime import date
+from decimal import Decimal
+import json
+
+from sure import expect
+
+from app import domain, models
+from app.http_app import web_app
+from tests.base import AppTestCase
+
+
+class PaymentsSummaryTest(AppTestCase):
+    def setUp(self):
+        super(PaymentsSummaryTest, self).setUp()
+        self.today = date.today()
+        # a late, a due today, a due tomorrow and a pending debt, as far as this month has those days
+        days = [day for day in (self.today.day - 1, self.today.day, self.today.day + 1, self.today.day + 2) if 1 <= day <= 28]
+        self.user_id = self.create_user(debts=[
+            {'expiration_day': day, 'value': Decimal(index + 1), 'quantity': None} for index, day in enumerate(days + days[:1])
+        ])
+        self.send_as(self.user_id, 'POST', '/api/me/payments', {'year': self.today.year, 'month': self.today.month})
+        with web_app.app_context():
+            payment = models.UserPayment.query.filter_by(user_id=self.user_id).order_by(models.UserPayment.id.desc()).first()
+            payment_id = payment.id
+        self.send_as(self.user_id, 'PUT', '/api/me/payments/batch', [{'id': payment_id, 'isPayed': True}])
+
+    def summary(self, **params):
+        query = '&'.join('{}={}'.format(*item) for item in params.items())
+        return self.get_as(self.user_id, '/api/me/payments/summary?' + query)
+
+    def test_counts_the_statuses_the_payments_have(self):
+        with web_app.app_context():
+            payments = domain.User.create_with_id(self.user_id).list_payments_for(self.today.year, self.today.month)
+            expected = Counter(payment.status for payment in payments)
+        statuses = json.loads(self.summary(year=self.today.year, month=self.today.month).data)['statuses']
+        expect({status: values['count'] for status, values in statuses.items() if values['count']}).to.equal(dict(expected))
+        expect(statuses['payed']['count']).to.equal(1)
+
+    def test_refuses_a_month_out_of_range(self):
+        expect(self.summary(year=2026, month=13).status_code).to.equal(400)
+        expect(self.summary(year=2026, month=0).status_code).to.equal(400)
+        expect(self.summary(year=2026, month='may').status_code).to.equal(400)